@@ -1,6 +1,8 @@
-
+import os
 import glob
+from multiprocessing import Pool, cpu_count
 from gensim import corpora, models
+from gensim.utils import grouper
 from nltk.tokenize import RegexpTokenizer
 #from stop_words import get_stop_words
 
@@ -8,6 +10,12 @@ import logging
 logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
 
 
+DOCUMENTS = "blogdataset/documents.tmp"
+TOKENS = "blogdataset/tokens.tmp"
+CORPUS = "blogdataset/corpus.mm"
+
+tokenizer = RegexpTokenizer(r'\w+')
+
 def process_filename(filename):
     stream = open(filename, encoding="utf8")
     result = []
@@ -19,7 +27,7 @@ def process_filename(filename):
         return result
     except:
         return result
-    
+
 
 class Example:
     def __init__(self, u, a, g, text):
@@ -32,49 +40,67 @@ class Example:
     def __str__(self):
         return "{}\t{}\t{}\t{}\t{}".format(self.topic, self.age, self.gender, self.user, self.text)
 
-def main():
+
+def process_user(job):
+    # parses and tokenizes one blog file (runs in a worker process)
+    filename, a, g = job
+    user = filename.split("/")[-1].split(".")[0]
+    documents = process_filename(filename)
+    return [(Example(user, a, g, doc), tokenizer.tokenize(doc.lower())) for doc in documents]
+
+def iter_examples():
+    for line in open(DOCUMENTS, encoding="utf8"):
+        u, a, g, text = line.rstrip("\n").split("\t", 3)
+        yield Example(u, a, g, text)
+
+def iter_tokens():
+    for line in open(TOKENS, encoding="utf8"):
+        yield line.split()
+
+def main(workers=max(1, cpu_count() - 1), batch_size=2000):
     age = [1, 3]
     gen = ["m", "f"]
-    
-    examples = []
+
+    jobs = []
     for a in age:
         for g in gen:
             for filename in glob.glob("blogdataset/{}_{}/*".format(g, a)):
-                documents = process_filename(filename)
-                
-                user = filename.split("/")[-1].split(".")[0]
-                
-                examples += [Example(user, a, g, doc) for doc in documents]
-    
-    
-    preprocessed_docs = []
-    
-    tokenizer = RegexpTokenizer(r'\w+')
-    
-    for doc in examples:
-        tokenized = tokenizer.tokenize(doc.text.lower())
-        preprocessed_docs.append(tokenized)
-    
-    dictionary = corpora.Dictionary(preprocessed_docs)
+                jobs.append((filename, a, g))
+
+    # documents and tokens are streamed to disk instead of kept in memory
+    documents = open(DOCUMENTS, "w", encoding="utf8")
+    tokens = open(TOKENS, "w", encoding="utf8")
+    with Pool(workers) as pool:
+        for result in pool.imap(process_user, jobs, chunksize=16):
+            for ex, tokenized in result:
+                documents.write("{}\t{}\t{}\t{}\n".format(ex.user, ex.age, ex.gender, ex.text))
+                tokens.write(" ".join(tokenized) + "\n")
+    documents.close()
+    tokens.close()
+
+    dictionary = corpora.Dictionary(iter_tokens())
     dictionary.filter_extremes(no_below=2, no_above=0.5)
-    corpus = [dictionary.doc2bow(text) for text in preprocessed_docs]
+    corpora.MmCorpus.serialize(CORPUS, (dictionary.doc2bow(text) for text in iter_tokens()))
+    corpus = corpora.MmCorpus(CORPUS)
 
-    
     print("Training LDA")
-    ldamodel = models.ldamodel.LdaModel(corpus, num_topics=10, id2word = dictionary, passes=20)
-    
-    for ex, doc in zip(examples, corpus):
-        topics = ldamodel.get_document_topics(doc)
-        values =[b for _, b in topics]
-        if max(values) > 0.8:
-            topic = max(topics, key = lambda x: x[1])[0]
-            ex.topic = topic
-    
-    
+    ldamodel = models.ldamulticore.LdaMulticore(corpus, num_topics=10, id2word = dictionary, passes=20, workers=workers)
+
     out = open("blogdataset/dataset", "w")
-    for ex in examples:
-        out.write(str(ex) + "\n")
-    
+    examples = iter_examples()
+    for chunk in grouper(corpus, batch_size):
+        gamma, _ = ldamodel.inference(chunk)
+        for g, ex in zip(gamma, examples):
+            # same distribution as ldamodel.get_document_topics
+            values = g / g.sum()
+            if max(values) > 0.8:
+                ex.topic = values.argmax()
+            out.write(str(ex) + "\n")
+    out.close()
+
+    for filename in [DOCUMENTS, TOKENS]:
+        os.remove(filename)
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -8,6 +8,8 @@ random.seed(10)
 from collections import defaultdict
 
 import ner
+import tokenization
+import dataset_cache
 from example import Example
 
 from xml.sax.saxutils import unescape
@@ -26,42 +28,67 @@ def count_NE(dataset):
                 counts[e] += 1
     return counts
 
-def get_dataset(k = 4):
-    
-    keys = ["source", "url", "title", "image", "category", "description", "rank", "pubdate"]
-    filename = "../datasets/newsspace200.xml"
-    
-    xml_tree = ET.parse(filename)
-    root = xml_tree.getroot()
-    
-    categories = ["World", "Entertainment", "Sports", "Business"]
-    # "Top Stories", "Sci/Tech", "Top News", "Europe", "Health", "Italia", "U.S."]
-    label_map = dict(zip(categories, range(len(categories))))
-    
-    #sources = ["Yahoo Business", "Reuters Business", "Washington Post Business", "BBC News Business"]
-    #source_map = dict(zip(sources, range(len(sources))))
-    
-    
-    examples = []
+KEYS = ["source", "url", "title", "image", "category", "description", "rank", "pubdate"]
+
+CATEGORIES = ["World", "Entertainment", "Sports", "Business"]
+# "Top Stories", "Sci/Tech", "Top News", "Europe", "Health", "Italia", "U.S."]
+
+def iter_records(filename, label_map, limit=None):
+    """Streams (description, label) pairs from the xml file.
+
+    Each field element is cleared once read, so memory is bounded by one
+    record. Stops after limit records whose category is in label_map.
+    """
+    context = ET.iterparse(filename, events=("start", "end"))
+    _, root = next(context)
     
+    depth = 0
     i = 0
+    n = 0
     d = []
-    for c in root:
-        assert(c.tag == keys[i%len(keys)])
+    for event, c in context:
+        if event == "start":
+            depth += 1
+            continue
+        depth -= 1
+        if depth > 0 or c is root:
+            continue
+        assert(c.tag == KEYS[i%len(KEYS)])
         d.append(c.text)
-        if len(d) == len(keys):
+        # drops c (and its already consumed siblings) from the tree
+        root.clear()
+        if len(d) == len(KEYS):
             if d[4] in label_map:
                 description = d[2]
                 if d[5] is not None:
                     description +=  "  " + d[5]
-                ex = Example(preprocess(description), 
-                             label = label_map[d[4]],
-                             #metadata = [source_map[d[0]]])
-                             )
-                examples.append(ex)
+                #metadata = [source_map[d[0]]]
+                yield preprocess(description), label_map[d[4]]
+                n += 1
+                if limit is not None and n >= limit:
+                    return
             d = []
         i += 1
 
+def iter_examples(filename, label_map, limit=None):
+    for text, label in iter_records(filename, label_map, limit):
+        yield Example(text, label=label)
+
+@dataset_cache.cached("ag")
+def get_dataset(k = 4):
+    
+    filename = "../datasets/newsspace200.xml"
+    
+    label_map = dict(zip(CATEGORIES, range(len(CATEGORIES))))
+    
+    #sources = ["Yahoo Business", "Reuters Business", "Washington Post Business", "BBC News Business"]
+    #source_map = dict(zip(sources, range(len(sources))))
+    
+    records = list(iter_records(filename, label_map))
+
+    tokens = tokenization.tokenize_all([text for text, _ in records], "ag_corpus")
+    examples = [Example(text, label=label, tokens=toks) for (text, label), toks in zip(records, tokens)]
+
     examples = ner.tags_NE(examples, "ag_corpus", k=k)
     
     random.shuffle(examples)
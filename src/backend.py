@@ -0,0 +1,56 @@
+import os
+
+"""
+DyNet runtime profiles.
+
+A profile sets the execution mode of computation graphs (immediate or
+lazy execution, validity checks), autobatching, the size of the memory
+pools (in MB, dynet grows them when needed) and the number of intra-op
+threads (OMP_NUM_THREADS / MKL_NUM_THREADS, used by dynet builds with
+OpenMP or MKL, 0 = all cores).
+
+init must be called before the dynet module is first imported, and every
+graph must be created with renew_cg. This module does not import dynet
+at load time, so that main.py --help stays fast.
+"""
+
+PROFILES = {
+    # eager execution, NaN / inf checks: errors are raised where they happen
+    "debug":      {"immediate_compute": True,  "check_validity": True,  "autobatch": 0, "mem": "512",  "threads": 1},
+    # lazy execution, no checks. Models are batched explicitly (--batch-size):
+    # dynet autobatching was slower in benchmark.py profiles
+    "throughput": {"immediate_compute": False, "check_validity": False, "autobatch": 0, "mem": "1024", "threads": 0},
+    # lazy execution, small initial pools
+    "low-memory": {"immediate_compute": False, "check_validity": False, "autobatch": 0, "mem": "128",  "threads": 1},
+}
+
+# profile in use
+NAME = "debug"
+PROFILE = PROFILES[NAME]
+
+
+def init(profile="debug", seed=0, weight_decay=0, **overrides):
+    """Initializes dynet with a profile, values in overrides replace those of the profile"""
+    global NAME, PROFILE
+    import dynet_config
+
+    NAME = profile
+    PROFILE = dict(PROFILES[profile])
+    PROFILE.update({k: v for k, v in overrides.items() if v is not None})
+
+    threads = PROFILE["threads"] or os.cpu_count()
+    for var in ["OMP_NUM_THREADS", "MKL_NUM_THREADS"]:
+        os.environ[var] = str(threads)
+
+    dynet_config.set(mem=str(PROFILE["mem"]), random_seed=seed, autobatch=PROFILE["autobatch"], weight_decay=weight_decay)
+    import dynet
+    return PROFILE
+
+
+def describe():
+    return "{} ({})".format(NAME, ", ".join("{}={}".format(k, v) for k, v in sorted(PROFILE.items())))
+
+
+def renew_cg():
+    import _dynet as dy
+    dy.renew_cg(immediate_compute = PROFILE["immediate_compute"], check_validity = PROFILE["check_validity"])
@@ -0,0 +1,409 @@
+import sys
+import argparse
+import random
+import time
+import subprocess
+import numpy as np
+from collections import Counter
+
+import backend
+
+"""
+Speed benchmarks on synthetic data (random words and sentences), with
+randomly initialized models. bi compares a new code path with the path
+it replaces and numpy compares the numpy inference engine with dynet
+graphs, both check that the results are the same. profiles times one
+training epoch with each runtime profile of backend.py, encoders with
+each sentence encoder of encoders.py. cells reports the time per token
+and the test accuracy of each RNN cell on a fixed subset (first n
+training examples) of a dataset or of a synthetic task. adversary
+times the attacker on random hidden vectors.
+
+    python benchmark.py bi [--use-char-lstm] [-n 500]
+    python benchmark.py profiles [--bidirectional] [--use-char-lstm]
+    python benchmark.py encoders -B 16 [--use-char-lstm]
+    python benchmark.py cells -B 16 -n 2000 [--data tp_fr] [--use-char-lstm]
+    python benchmark.py adversary -n 10000 -B 64
+    python benchmark.py numpy -n 2000 -B 32 [--bidirectional] [--use-char-lstm]
+"""
+
+
+def random_corpus(n_sentences, max_length=40, n_types=2000, seed=0):
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    # zipfian-ish word frequencies
+    types = ["".join(rng.choice(letters) for _ in range(rng.randint(1, 12))) for _ in range(n_types)]
+    weights = [1 / (i + 1) for i in range(n_types)]
+    return [rng.choices(types, weights, k=rng.randint(1, max_length)) for _ in range(n_sentences)]
+
+
+def timeit(function, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        result = function()
+        t = time.time() - start
+        best = t if best is None else min(best, t)
+    return best, result
+
+
+def report(name, t_old, t_new, error=None):
+    line = "{}\told={:.3f}s\tnew={:.3f}s\tspeedup={:.2f}".format(name, t_old, t_new, t_old / t_new)
+    if error is not None:
+        line += "\tmax abs diff={:.2e}".format(error)
+    print(line)
+
+
+def build_representations_bi_old(self, example, training, prefix=[]):
+    # bilstm.HierarchicalBiLSTM.build_representations_bi before the shared static embeddings
+    import dynet as dy
+    backend.renew_cg()
+    coded_sentence = self.vocabulary.code_example(example, training)
+    coded_prefix = self.vocabulary.code_sentence_cw(prefix, training)
+
+    w_init_f = self.wrnn[0].initial_state()
+    w_init_b = self.wrnn[1].initial_state()
+
+    f_lstm_input = self.get_static_representations(coded_prefix + coded_sentence)
+    b_lstm_input = self.get_static_representations(coded_prefix + list(reversed(coded_sentence)))
+
+    contextual_embeddings = [
+        w_init_f.transduce(f_lstm_input),
+        list(reversed(w_init_b.transduce(b_lstm_input)))
+    ]
+
+    return (dy.concatenate([contextual_embeddings[0][-1],
+                            contextual_embeddings[1][0]]),
+            [dy.concatenate(list(fb)) for fb in zip(*contextual_embeddings)])
+
+
+def benchmark_bi(args):
+    import dynet as dy
+    from bilstm import HierarchicalBiLSTM
+    from vocabulary import Vocabulary
+    from example import Example
+
+    sentences = random_corpus(args.n)
+    examples = [Example(None, 0, tokens=s) for s in sentences]
+    voc = Vocabulary(Counter(w for s in sentences for w in s))
+    bi = args.bidirectional
+    args.bidirectional = True
+    model = dy.ParameterCollection()
+    bilstm = HierarchicalBiLSTM(args, voc, model)
+    args.bidirectional = bi
+
+    bilstm.disable_dropout()
+    def old():
+        return [build_representations_bi_old(bilstm, ex, False)[0].npvalue() for ex in examples]
+
+    def new():
+        return [bilstm.build_representations(ex, False)[0].npvalue() for ex in examples]
+
+    t_old, v_old = timeit(old)
+    t_new, v_new = timeit(new)
+    report("bi eval", t_old, t_new, max(np.abs(a - b).max() for a, b in zip(v_old, v_new)))
+
+    # forward and backward passes, as in training (without updates)
+    bilstm.set_dropout(0.2)
+    def old():
+        for ex in examples:
+            dy.sum_elems(build_representations_bi_old(bilstm, ex, True)[0]).backward()
+
+    def new():
+        for ex in examples:
+            dy.sum_elems(bilstm.build_representations(ex, True)[0]).backward()
+
+    t_old, _ = timeit(old)
+    t_new, _ = timeit(new)
+    report("bi train", t_old, t_new)
+
+
+def train_epoch(args, examples, voc):
+    # time of one training epoch (encoder + classifier)
+    import dynet as dy
+    from encoders import ENCODERS
+    from classifier import MLP
+    from main import make_batches
+
+    model = dy.ParameterCollection()
+    bilstm = ENCODERS[args.encoder](args, voc, model)
+    classifier = MLP(bilstm.size(), 2, 1, 50, dy.rectify, model)
+    trainer = dy.AdamTrainer(model)
+
+    bilstm.set_dropout(0.2)
+    start = time.time()
+    for batch in make_batches(examples, args.batch_size):
+        batch = [examples[i] for i in batch]
+        if len(batch) == 1:
+            input = bilstm.build_representations(batch[0], True)[0]
+            loss = classifier.get_loss(input, batch[0].get_label())
+        else:
+            input = bilstm.build_batch_representations(batch, True)
+            loss = classifier.get_batch_loss(input, [ex.get_label() for ex in batch]) / len(batch)
+        loss.backward()
+        trainer.update()
+    return time.time() - start
+
+
+def benchmark_train(args):
+    # one training epoch with the profile of this process
+    import resource
+    from vocabulary import Vocabulary
+    from example import Example
+
+    sentences = random_corpus(args.n)
+    examples = [Example(None, i % 2, tokens=s) for i, s in enumerate(sentences)]
+    voc = Vocabulary(Counter(w for s in sentences for w in s))
+    t = train_epoch(args, examples, voc)
+
+    # ru_maxrss is in KB
+    memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print("train\t{}\tB={}\t{:.3f}s\tmax RSS={:.0f}MB".format(backend.NAME, args.batch_size, t, memory))
+
+
+def benchmark_encoders(args):
+    # one training epoch with each encoder, relative to the LSTM
+    import dynet as dy
+    from encoders import ENCODERS
+    from vocabulary import Vocabulary
+    from example import Example
+
+    sentences = random_corpus(args.n)
+    examples = [Example(None, i % 2, tokens=s) for i, s in enumerate(sentences)]
+    voc = Vocabulary(Counter(w for s in sentences for w in s))
+    times = {}
+    for encoder in ENCODERS:
+        args.encoder = encoder
+        times[encoder] = min(train_epoch(args, examples, voc) for _ in range(3))
+
+    # pooled encoders: batched and single example vectors are the same
+    for encoder in ["boe", "cnn"]:
+        args.encoder = encoder
+        model = dy.ParameterCollection()
+        pooled = ENCODERS[encoder](args, voc, model)
+        pooled.disable_dropout()
+        batch = examples[:16]
+        batched = pooled.build_batch_representations(batch, False).npvalue()
+        single = np.array([pooled.build_representations(ex, False)[0].npvalue() for ex in batch]).T
+        report("{} vs lstm B={}".format(encoder, args.batch_size), times["lstm"], times[encoder], np.abs(batched - single).max())
+
+
+def cells_data(args):
+    # fixed subset of a dataset, or a synthetic task: is there a given word in the first half of the sentence
+    from vocabulary import Vocabulary
+    from example import Example
+    if args.data is not None:
+        import dataset_registry
+        from main import extract_vocabulary
+        train, dev, test = dataset_registry.get_dataset(args.data, args)
+        train, test = train[:args.n], test[:args.n // 5]
+        return train, test, extract_vocabulary(train)
+    sentences = random_corpus(args.n + args.n // 5)
+    counts = Counter(w for s in sentences for w in s)
+    marker = counts.most_common(4)[-1][0]
+    examples = [Example(None, int(marker in s[:len(s) // 2]), tokens=s) for s in sentences]
+    return examples[:args.n], examples[args.n:], Vocabulary(counts)
+
+
+def benchmark_cells(args):
+    # forward / backward time per token and test accuracy with each RNN cell
+    import dynet as dy
+    from bilstm import CELLS, HierarchicalBiLSTM
+    from classifier import MLP
+    from main import make_batches
+
+    train, test, voc = cells_data(args)
+    n_tokens = sum(len(ex.get_token_ids()) for ex in train) * args.epochs
+    n_labels = max(ex.get_label() for ex in train + test) + 1
+    for cell in CELLS:
+        args.cell = cell
+        model = dy.ParameterCollection()
+        bilstm = HierarchicalBiLSTM(args, voc, model)
+        classifier = MLP(bilstm.size(), n_labels, 1, 50, dy.rectify, model)
+        trainer = dy.AdamTrainer(model)
+
+        t_forward = t_backward = 0
+        for _ in range(args.epochs):
+            bilstm.set_dropout(0.2)
+            for batch in make_batches(train, args.batch_size):
+                batch = [train[i] for i in batch]
+                start = time.time()
+                input = bilstm.build_batch_representations(batch, True)
+                loss = classifier.get_batch_loss(input, [ex.get_label() for ex in batch]) / len(batch)
+                # forces the forward pass in lazy profiles
+                loss.value()
+                t_forward += time.time() - start
+                start = time.time()
+                loss.backward()
+                trainer.update()
+                t_backward += time.time() - start
+
+        bilstm.disable_dropout()
+        correct = 0
+        for batch in make_batches(test, args.batch_size, shuffle=False):
+            batch = [test[i] for i in batch]
+            targets = [ex.get_label() for ex in batch]
+            _, predictions = classifier.get_batch_loss_and_prediction(bilstm.build_batch_representations(batch, False), targets)
+            correct += sum(p == t for p, t in zip(predictions, targets))
+
+        print("{}\tforward={:.1f}us/token\tbackward={:.1f}us/token\ttest acc={:.1f}".format(
+            cell, t_forward / n_tokens * 1e6, t_backward / n_tokens * 1e6, correct / len(test) * 100))
+
+
+def adversary_data(args, n_labels=4):
+    # random hidden vectors and multi-hot labels, as returned by PrModel.get_adversary_dataset
+    rng = np.random.RandomState(0)
+    X = rng.randn(args.n, args.dim_wrnn).astype(np.float32)
+    Y = (rng.rand(args.n, n_labels) > 0.5).astype(np.int8)
+    return X, Y
+
+
+def benchmark_adversary(args):
+    # attacker evaluation (one graph per example vs one batch for the whole dataset) and training
+    import dynet as dy
+    from classifier import MLP_sigmoid
+
+    X, Y = adversary_data(args)
+    targets = [set(np.nonzero(y)[0].tolist()) for y in Y]
+    model = dy.ParameterCollection()
+    classifier = MLP_sigmoid(X.shape[1], Y.shape[1], 2, 128, dy.rectify, model)
+
+    def old():
+        losses = []
+        for x, t in zip(X, targets):
+            backend.renew_cg()
+            loss, _ = classifier.get_loss_and_prediction(dy.inputVector(x.tolist()), t)
+            losses.append(loss.value())
+        return np.array(losses)
+
+    def new():
+        backend.renew_cg()
+        return classifier.get_matrix_loss_and_prediction(X, Y)[0]
+
+    t_old, v_old = timeit(old)
+    t_new, v_new = timeit(new)
+    report("adversary eval", t_old, t_new, np.abs(v_old - v_new).max())
+
+    # one training epoch: one graph and update per example vs minibatches of -B rows
+    trainer = dy.AdamTrainer(model)
+    def old():
+        for x, t in zip(X, targets):
+            backend.renew_cg()
+            classifier.get_loss(dy.inputVector(x.tolist()), t).backward()
+            trainer.update()
+
+    def new():
+        order = np.random.permutation(len(X))
+        for i in range(0, len(X), args.batch_size):
+            batch = order[i:i+args.batch_size]
+            backend.renew_cg()
+            (classifier.get_matrix_loss(X[batch], Y[batch]) / len(batch)).backward()
+            trainer.update()
+
+    t_old, _ = timeit(old, repeat=1)
+    t_new, _ = timeit(new, repeat=1)
+    report("adversary train B={}".format(args.batch_size), t_old, t_new)
+
+
+def benchmark_numpy(args):
+    # inference on a dev / test sized set: dynet graphs (per example, batched) vs numpy engine
+    import dynet as dy
+    from bilstm import HierarchicalBiLSTM
+    from classifier import MLP
+    from vocabulary import Vocabulary
+    from example import Example
+    from main import make_batches
+    from numpy_inference import NumpyEncoder, NumpyMLP
+
+    sentences = random_corpus(args.n)
+    examples = [Example(None, i % 2, tokens=s) for i, s in enumerate(sentences)]
+    targets = [ex.get_label() for ex in examples]
+    voc = Vocabulary(Counter(w for s in sentences for w in s))
+    model = dy.ParameterCollection()
+    bilstm = HierarchicalBiLSTM(args, voc, model)
+    classifier = MLP(bilstm.size(), 2, 1, 50, dy.rectify, model)
+    bilstm.disable_dropout()
+
+    # each pass starts without char encodings (see HierarchicalBiLSTM.get_char_encodings)
+    def dynet_single():
+        bilstm.char_table = {}
+        losses = []
+        for ex in examples:
+            loss, _ = classifier.get_loss_and_prediction(bilstm.build_representations(ex, False)[0], ex.get_label())
+            losses.append(loss.value())
+        return np.array(losses)
+
+    def dynet_batched():
+        bilstm.char_table = {}
+        losses = np.zeros(len(examples))
+        for batch in make_batches(examples, args.batch_size, shuffle=False):
+            input = bilstm.build_batch_representations([examples[i] for i in batch], False)
+            losses[batch] = classifier.get_batch_loss_and_prediction(input, [targets[i] for i in batch])[0]
+        return losses
+
+    def numpy_batched():
+        encoder = NumpyEncoder(bilstm)
+        mlp = NumpyMLP(classifier)
+        losses = np.zeros(len(examples))
+        for batch in make_batches(examples, 256, shuffle=False):
+            X = encoder.encode([examples[i] for i in batch])
+            losses[batch] = mlp.get_loss_and_prediction(X, [targets[i] for i in batch])[0]
+        return losses
+
+    t_old, v_old = timeit(dynet_single)
+    t_new, v_new = timeit(numpy_batched)
+    report("numpy vs dynet B=1", t_old, t_new, np.abs(v_old - v_new).max())
+    t_old, v_old = timeit(dynet_batched)
+    report("numpy vs dynet B={}".format(args.batch_size), t_old, t_new, np.abs(v_old - v_new).max())
+
+
+def benchmark_profiles(args):
+    # one process per profile: dynet can only be initialized once
+    for batch_size in [1, 16]:
+        for profile in backend.PROFILES:
+            command = [sys.executable, __file__, "train", "--profile", profile, "-B", str(batch_size), "-n", str(args.n),
+                       "-c", str(args.dim_char), "-C", str(args.dim_crnn), "-w", str(args.dim_word), "-W", str(args.dim_wrnn)]
+            if args.use_char_lstm:
+                command.append("--use-char-lstm")
+            if args.bidirectional:
+                command.append("--bidirectional")
+            command += ["--cell", args.cell]
+            subprocess.run(command)
+
+
+BENCHMARKS = {"bi": benchmark_bi,
+              "numpy": benchmark_numpy,
+              "train": benchmark_train,
+              "encoders": benchmark_encoders,
+              "cells": benchmark_cells,
+              "adversary": benchmark_adversary,
+              "profiles": benchmark_profiles}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("benchmark", choices=list(BENCHMARKS))
+    parser.add_argument("-n", type=int, default=500, help="Number of sentences")
+    parser.add_argument("--dynet-seed", type=int, default=4, help="random seed for dynet")
+    parser.add_argument("--dim-char", "-c", type=int, default=50)
+    parser.add_argument("--dim-crnn", "-C", type=int, default=50)
+    parser.add_argument("--dim-word", "-w", type=int, default=50)
+    parser.add_argument("--dim-wrnn", "-W", type=int, default=50)
+    parser.add_argument("--use-char-lstm", action="store_true")
+    parser.add_argument("--max-tokens", type=int, default=None)
+    parser.add_argument("--bidirectional", action="store_true")
+    parser.add_argument("--encoder", choices=["lstm", "boe", "cnn"], default="lstm")
+    parser.add_argument("--cell", choices=["vanilla", "compact", "gru"], default="vanilla")
+    parser.add_argument("--epochs", type=int, default=3, help="cells: training epochs")
+    parser.add_argument("--data", default=None, help="cells: dataset id (see dataset_registry.py), default: synthetic task")
+    parser.add_argument("--num-NE", "-k", type=int, default=4)
+    parser.add_argument("--cnn-window", type=int, default=3)
+    parser.add_argument("--batch-size", "-B", type=int, default=1)
+    parser.add_argument("--profile", choices=list(backend.PROFILES), default="debug", help="Dynet runtime profile")
+
+    args = parser.parse_args()
+
+    backend.init(args.profile, args.dynet_seed)
+
+    BENCHMARKS[args.benchmark](args)
@@ -5,9 +5,31 @@ import numpy as np
 import sys
 
 import vocabulary
+import backend
 
 F, B = 0, 1
 
+# dynet RNN builders (--cell). dy.LSTMBuilder is the vanilla LSTM
+CELLS = {"vanilla": dy.VanillaLSTMBuilder,
+         "compact": dy.CompactVanillaLSTMBuilder,
+         "gru": dy.GRUBuilder}
+
+
+def rnn_builder(cell, dim_input, dim_output, model):
+    return CELLS[cell](1, dim_input, dim_output, model)
+
+
+def reset_dropout_masks(builder, batch_size):
+    # LSTM builders: masks are sized on the first batch of a graph (see transduce_batch).
+    # The GRU builder has no set_dropout_masks, and handles several batch sizes in a graph
+    if hasattr(builder, "set_dropout_masks"):
+        builder.set_dropout_masks(batch_size)
+
+
+def reverse_sentence(sequence, n_prefix):
+    # input of the backward LSTM: the prefix, then the sentence from right to left
+    return sequence[:n_prefix] + sequence[n_prefix:][::-1]
+
 
 class HierarchicalBiLSTM:
     
@@ -15,80 +37,142 @@ class HierarchicalBiLSTM:
         
         self.vocabulary = vocabulary
         self.bi = args.bidirectional
+        self.cell = args.cell
         
         if args.use_char_lstm:
-            self.crnn = [dy.LSTMBuilder(1, args.dim_char, args.dim_crnn, model),
-                         dy.LSTMBuilder(1, args.dim_char, args.dim_crnn, model)]
+            self.crnn = [rnn_builder(self.cell, args.dim_char, args.dim_crnn, model),
+                         rnn_builder(self.cell, args.dim_char, args.dim_crnn, model)]
             
             self.chars = model.add_lookup_parameters((vocabulary.size_chars(), args.dim_char))
         else:
             self.crnn = None
             self.chars = None
 
+        # char LSTM encodings of word types, see get_char_encodings
+        self.char_memo = {}
+        self.char_memo_cg = None
+        self.char_table = None
+
         dim_input = args.dim_word
         if args.use_char_lstm:
             dim_input += args.dim_crnn * 2
+        self.dim_input = dim_input
 
-        self.wrnn = [dy.LSTMBuilder(1, dim_input, args.dim_wrnn, model),
-                     dy.LSTMBuilder(1, dim_input, args.dim_wrnn, model)]
+        self.build_word_level(args, model)
         
         self.words = model.add_lookup_parameters((vocabulary.size_words(), args.dim_word))
-        
-        
+
+        # token budget: longer examples are truncated
+        self.max_tokens = args.max_tokens
+
+    def build_word_level(self, args, model):
+        # parameters of the sentence encoder (see encoders.py for others)
+        self.wrnn = [rnn_builder(self.cell, self.dim_input, args.dim_wrnn, model),
+                     rnn_builder(self.cell, self.dim_input, args.dim_wrnn, model)]
         self._size = args.dim_wrnn *2 if self.bi else args.dim_wrnn
 
+    def code_example(self, example, training):
+        coded_sentence = self.vocabulary.code_example(example, training)
+        if self.max_tokens is not None:
+            return coded_sentence[:self.max_tokens]
+        return coded_sentence
+
     def get_static_representations(self, coded_sentence):
         
         word_embeddings = [self.words[token[0]] for token in coded_sentence]
         if self.crnn is None:
             return word_embeddings
         else:
-            
-            char_embeddings = [[self.chars[i] for i in token[1]] for token in coded_sentence]
+            char_encodings = self.get_char_encodings([token[1] for token in coded_sentence])
+            return [dy.concatenate([c_e, w_e]) for c_e, w_e in zip(char_encodings, word_embeddings)]
+
+    def get_char_encodings(self, char_sequences, chunk_size=256):
+        """Char LSTM encodings (forward and backward) of a list of words.
 
-            c_init_f = self.crnn[F].initial_state()
-            c_init_b = self.crnn[B].initial_state()
+        Each distinct word is encoded once per computation graph, in
+        batched calls, and shared by all its occurrences. With dropout
+        disabled, values are also kept in a table for the whole pass, i.e.
+        until the next call to set_dropout or reset_char_table.
+        """
+        if self.char_memo_cg != dy.cg_version():
+            self.char_memo_cg = dy.cg_version()
+            self.char_memo = {}
+        keys = [tuple(c) for c in char_sequences]
+        missing = [k for k in dict.fromkeys(keys) if k not in self.char_memo]
+        if self.char_table is not None:
+            new = [k for k in missing if k not in self.char_table]
+        else:
+            new = missing
+        # sorted by length: little padding in each chunk
+        new.sort(key=len)
+        for i in range(0, len(new), chunk_size):
+            chunk = new[i:i+chunk_size]
+            encodings = self.encode_chars(chunk)
+            if self.char_table is not None:
+                values = encodings.npvalue().reshape(-1, len(chunk))
+                for b, k in enumerate(chunk):
+                    self.char_table[k] = values[:, b]
+            else:
+                for b, k in enumerate(chunk):
+                    self.char_memo[k] = dy.pick_batch_elem(encodings, b)
+        if self.char_table is not None:
+            for k in missing:
+                self.char_memo[k] = dy.inputTensor(self.char_table[k])
+        return [self.char_memo[k] for k in keys]
 
-            return [dy.concatenate([c_init_f.transduce(c_e)[-1],
-                                c_init_b.transduce(reversed(c_e))[-1],
-                                word_embeddings[i]])
-                for i, c_e in enumerate(char_embeddings)
-            ]
+    def encode_chars(self, char_sequences):
+        # batched expression, one element per char sequence
+        lengths = [len(c) for c in char_sequences]
+        T = max(lengths)
+        f_inputs = [dy.lookup_batch(self.chars, [c[t] if t < len(c) else vocabulary.UNDEF_I for c in char_sequences])
+                    for t in range(T)]
+        reverse = [c[::-1] for c in char_sequences]
+        b_inputs = [dy.lookup_batch(self.chars, [c[t] if t < len(c) else vocabulary.UNDEF_I for c in reverse])
+                    for t in range(T)]
+        states = [builder.initial_state() for builder in self.crnn]
+        for builder in self.crnn:
+            reset_dropout_masks(builder, len(lengths))
+        f_outputs = states[F].transduce(f_inputs)
+        b_outputs = states[B].transduce(b_inputs)
+        return dy.concatenate_to_batch([dy.concatenate([dy.pick_batch_elem(f_outputs[l-1], b),
+                                                        dy.pick_batch_elem(b_outputs[l-1], b)])
+                                        for b, l in enumerate(lengths)])
 
 
-    def build_representations(self, sentence, training, prefix = [], do_not_renew=False):
+    def build_representations(self, example, training, prefix = [], do_not_renew=False, token_outputs=False):
+        """Returns the sentence vector, and the list of token vectors if token_outputs (None otherwise)"""
         if self.bi:
-            return self.build_representations_bi(sentence, training, prefix, do_not_renew)
+            return self.build_representations_bi(example, training, prefix, do_not_renew, token_outputs)
         else:
-            return self.build_representations_mono(sentence, training, prefix, do_not_renew)
+            return self.build_representations_mono(example, training, prefix, do_not_renew, token_outputs)
 
-    def build_representations_bi(self, sentence, training, prefix = [], do_not_renew=False):
+    def build_representations_bi(self, example, training, prefix = [], do_not_renew=False, token_outputs=False):
         if not do_not_renew:
-            dy.renew_cg(immediate_compute = True, check_validity = True)
-        coded_sentence = self.vocabulary.code_sentence_cw(sentence, training)
+            backend.renew_cg()
+        coded_sentence = self.code_example(example, training)
         coded_prefix = self.vocabulary.code_sentence_cw(prefix, training)
         
         w_init_f = self.wrnn[F].initial_state()
         w_init_b = self.wrnn[B].initial_state()
 
-        f_lstm_input = self.get_static_representations(coded_prefix + coded_sentence)
-        b_lstm_input = self.get_static_representations(coded_prefix + list(reversed(coded_sentence)))
+        # the backward LSTM reads the same static embeddings: prefix, then the reversed sentence
+        lstm_input = self.get_static_representations(coded_prefix + coded_sentence)
         
-        contextual_embeddings = [
-            w_init_f.transduce(f_lstm_input),
-            list(reversed(w_init_b.transduce(b_lstm_input)))
-        ]
+        f_outputs = w_init_f.transduce(lstm_input)
+        b_outputs = w_init_b.transduce(reverse_sentence(lstm_input, len(coded_prefix)))
 
-        return (dy.concatenate([contextual_embeddings[F][-1],
-                                contextual_embeddings[B][0]]),
-                [dy.concatenate(list(fb)) for fb in zip(*contextual_embeddings)])
+        encoding = dy.concatenate([f_outputs[-1], b_outputs[-1]])
+        if not token_outputs:
+            return encoding, None
+        return (encoding,
+                [dy.concatenate(list(fb)) for fb in zip(f_outputs, reversed(b_outputs))])
 
-    def build_representations_mono(self, sentence, training, prefix = [], do_not_renew=False):
+    def build_representations_mono(self, example, training, prefix = [], do_not_renew=False, token_outputs=False):
         if not do_not_renew:
-            dy.renew_cg(immediate_compute = True, check_validity = True)
+            backend.renew_cg()
 
         
-        coded_sentence = self.vocabulary.code_sentence_cw(sentence, training)
+        coded_sentence = self.code_example(example, training)
         coded_prefix = self.vocabulary.code_sentence_cw(prefix, training)
         #print(prefix)
         #print(coded_prefix)
@@ -99,19 +183,95 @@ class HierarchicalBiLSTM:
         
         contextual_embeddings = w_init_f.transduce(f_lstm_input)
 
-        return (contextual_embeddings[-1], contextual_embeddings)
+        return (contextual_embeddings[-1], contextual_embeddings if token_outputs else None)
+
+    def build_batch_representations(self, examples, training, prefixes=None, do_not_renew=False):
+        """Encodes a minibatch of examples in one batched computation.
+
+        Returns a batched expression of dimension size() with one batch
+        element per example. Sequences are padded at the end and each
+        state is read at the last position of its own sequence, so padding
+        does not change the result. Batches of similar lengths (see
+        main.make_batches) keep padding small.
+        """
+        if not do_not_renew:
+            backend.renew_cg()
+        if prefixes is None:
+            prefixes = [[] for _ in examples]
+
+        forward = []
+        prefix_lengths = []
+        for example, prefix in zip(examples, prefixes):
+            coded_sentence = self.code_example(example, training)
+            coded_prefix = self.vocabulary.code_sentence_cw(prefix, training)
+            forward.append(coded_prefix + coded_sentence)
+            prefix_lengths.append(len(coded_prefix))
+        return self.encode_batch(forward, prefix_lengths)
+
+    def encode_batch(self, forward, prefix_lengths):
+        # forward: coded sequences (prefix + sentence), one per batch element
+        lengths = [len(c) for c in forward]
+
+        if self.crnn is None:
+            f_inputs = self.get_batch_static_representations(forward)
+        else:
+            # static embeddings are computed once and reused by the backward LSTM
+            self.get_char_encodings([token[1] for c in forward for token in c])
+            static = [self.get_static_representations(c) for c in forward]
+            f_inputs = self.pad_batch(static)
+
+        f_vectors = self.transduce_batch(self.wrnn[F], f_inputs, lengths)
+        if not self.bi:
+            return f_vectors
+
+        if self.crnn is None:
+            b_inputs = self.get_batch_static_representations([reverse_sentence(c, p) for c, p in zip(forward, prefix_lengths)])
+        else:
+            b_inputs = self.pad_batch([reverse_sentence(s, p) for s, p in zip(static, prefix_lengths)])
+        b_vectors = self.transduce_batch(self.wrnn[B], b_inputs, lengths)
+        return dy.concatenate([f_vectors, b_vectors])
+
+    def transduce_batch(self, builder, inputs, lengths):
+        # dynet sizes dropout masks on the first input of a graph: reset them for this batch
+        state = builder.initial_state()
+        reset_dropout_masks(builder, len(lengths))
+        outputs = state.transduce(inputs)
+        return dy.concatenate_to_batch([dy.pick_batch_elem(outputs[l-1], b) for b, l in enumerate(lengths)])
+
+    def get_batch_static_representations(self, coded_sequences):
+        # word embeddings only: one batched lookup per time step
+        T = max([len(c) for c in coded_sequences])
+        return [dy.lookup_batch(self.words, [c[t][0] if t < len(c) else vocabulary.UNDEF_I for c in coded_sequences])
+                for t in range(T)]
+
+    def pad_batch(self, sequences, dim=None):
+        # one batched expression per time step, from one list of expressions per batch element
+        T = max([len(s) for s in sequences])
+        padding = dy.zeros(dim if dim is not None else self.dim_input)
+        return [dy.concatenate_to_batch([s[t] if t < len(s) else padding for s in sequences])
+                for t in range(T)]
 
     def size(self):
         return self._size
 
     def set_dropout(self, v):
+        # training: parameters will change
+        self.char_table = None
         if self.crnn is not None:
             for c in self.crnn:
                 c.set_dropout(v)
         for w in self.wrnn:
             w.set_dropout(v)
     
+    def reset_char_table(self):
+        # parameters were replaced (e.g. model.populate): encodings are stale
+        if self.char_table is not None:
+            self.char_table = {}
+        self.char_memo_cg = None
+
     def disable_dropout(self):
+        if self.char_table is None:
+            self.char_table = {}
         if self.crnn is not None:
             for c in self.crnn:
                 c.disable_dropout()
@@ -119,3 +279,105 @@ class HierarchicalBiLSTM:
             w.disable_dropout()
 
 
+def split_chunks(coded_sentence, chunk_size, stop_id):
+    # sentences (ending with STOP), cut into chunks of at most chunk_size tokens
+    chunks = []
+    current = []
+    for token in coded_sentence:
+        current.append(token)
+        if token[0] == stop_id or len(current) == chunk_size:
+            chunks.append(current)
+            current = []
+    if current or not chunks:
+        chunks.append(current)
+    return chunks
+
+
+class ChunkedBiLSTM(HierarchicalBiLSTM):
+    """Hierarchical encoder for long documents.
+
+    The word level LSTMs encode the sentences or chunks of at most
+    chunk_size tokens of all examples independently, in one batch. A
+    document level LSTM (or mean / max pooling) aggregates the chunk
+    vectors of each example. With bptt_chunks, only the last bptt_chunks
+    chunks of an example are backpropagated through, the vectors of the
+    others are used as constants.
+    """
+    def __init__(self, args, vocabulary, model):
+        super().__init__(args, vocabulary, model)
+        self.chunk_size = args.chunk_size
+        self.bptt_chunks = args.bptt_chunks
+        self.aggregation = args.aggregation
+        if self.aggregation == "lstm":
+            self.drnn = [rnn_builder(self.cell, self._size, args.dim_wrnn, model),
+                         rnn_builder(self.cell, self._size, args.dim_wrnn, model)]
+        else:
+            self.drnn = None
+
+    def build_representations(self, example, training, prefix = [], do_not_renew=False, token_outputs=False):
+        # token outputs are not available in hierarchical mode
+        return self.build_batch_representations([example], training, [prefix], do_not_renew), None
+
+    def build_batch_representations(self, examples, training, prefixes=None, do_not_renew=False):
+        if not do_not_renew:
+            backend.renew_cg()
+        if prefixes is None:
+            prefixes = [[] for _ in examples]
+
+        # chunks of all the examples, each one read after the prefix
+        chunks = [[], []]
+        prefix_lengths = [[], []]
+        positions = []
+        for example, prefix in zip(examples, prefixes):
+            coded_sentence = self.code_example(example, training)
+            coded_prefix = self.vocabulary.code_sentence_cw(prefix, training)
+            ex_chunks = split_chunks(coded_sentence, self.chunk_size, self.vocabulary.w2i[vocabulary.STOP])
+            n_frozen = 0
+            if training and self.bptt_chunks is not None:
+                n_frozen = max(0, len(ex_chunks) - self.bptt_chunks)
+            ex_positions = []
+            for i, chunk in enumerate(ex_chunks):
+                group = 0 if i < n_frozen else 1
+                ex_positions.append((group, len(chunks[group])))
+                chunks[group].append(coded_prefix + chunk)
+                prefix_lengths[group].append(len(coded_prefix))
+            positions.append(ex_positions)
+
+        vectors = [None, None]
+        for group in [0, 1]:
+            if chunks[group]:
+                vectors[group] = self.encode_batch(chunks[group], prefix_lengths[group])
+        if vectors[0] is not None:
+            # truncated backprop: constants are not backpropagated through
+            values = vectors[0].npvalue().reshape(self._size, -1)
+            if values.shape[1] > 1:
+                vectors[0] = dy.inputTensor(values, batched=True)
+            else:
+                vectors[0] = dy.inputTensor(values[:, 0])
+
+        chunk_vectors = [[dy.pick_batch_elem(vectors[g], i) for g, i in ex_positions] for ex_positions in positions]
+        return self.aggregate(chunk_vectors)
+
+    def aggregate(self, chunk_vectors):
+        if self.aggregation == "mean":
+            return dy.concatenate_to_batch([dy.average(v) for v in chunk_vectors])
+        if self.aggregation == "max":
+            return dy.concatenate_to_batch([dy.emax(v) for v in chunk_vectors])
+        lengths = [len(v) for v in chunk_vectors]
+        f_vectors = self.transduce_batch(self.drnn[F], self.pad_batch(chunk_vectors, self._size), lengths)
+        if not self.bi:
+            return f_vectors
+        b_vectors = self.transduce_batch(self.drnn[B], self.pad_batch([v[::-1] for v in chunk_vectors], self._size), lengths)
+        return dy.concatenate([f_vectors, b_vectors])
+
+    def set_dropout(self, v):
+        super().set_dropout(v)
+        if self.drnn is not None:
+            for d in self.drnn:
+                d.set_dropout(v)
+
+    def disable_dropout(self):
+        super().disable_dropout()
+        if self.drnn is not None:
+            for d in self.drnn:
+                d.disable_dropout()
@@ -1,6 +1,8 @@
 
 from collections import defaultdict
 from example import Example
+import tokenization
+import dataset_cache
 
 import random
 random.seed(10)
@@ -9,7 +11,7 @@ from trustpilot_data_reader import GENDER, BIRTH, map_gender
 
 def read_data(filename):
     
-    examples = []
+    records = []
     
     for line in open(filename):
         
@@ -30,9 +32,10 @@ def read_data(filename):
             
             topic = int(topic)
             
-            examples.append(Example(text, topic, meta))
+            records.append((text, topic, meta))
     
-    return examples
+    tokens = tokenization.tokenize_all([r[0] for r in records], "bl_corpus")
+    return [Example(text, topic, meta, tokens=toks) for (text, topic, meta), toks in zip(records, tokens)]
 
 def get_balanced_distribution(examples):
     signatures = defaultdict(list)
@@ -54,6 +57,7 @@ def get_balanced_distribution(examples):
     random.shuffle(balanced_dataset)
     return balanced_dataset
 
+@dataset_cache.cached("bl")
 def get_dataset():
     examples = read_data("../datasets/blogdataset/dataset")
     
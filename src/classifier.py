@@ -3,6 +3,13 @@ import _dynet as dy
 import numpy as np
 
 
+def constant_batch(values):
+    # (dim, N) array as an expression with N batch elements (batched (dim, 1) arrays are not supported)
+    if values.shape[1] == 1:
+        return dy.inputTensor(values[:, 0])
+    return dy.inputTensor(values, batched=True)
+
+
 class MLP:
     def __init__(self, dim_in, dim_out, n_hidden, dim_hidden, activation, model):
         assert(n_hidden > 0)
@@ -49,6 +56,30 @@ class MLP:
         layers = self.compute_output_layer(input)
         return - dy.log(dy.pick(layers[-1], target) + epsilon), np.argmax(layers[-1].value())
 
+    # Minibatch versions: input is a batched expression, one target per batch element
+
+    def get_batch_loss(self, input, targets, epsilon = 1e-10):
+        layers = self.compute_output_layer(input)
+        return dy.sum_batches(- dy.log(dy.pick_batch(layers[-1], targets) + epsilon))
+
+    def get_batch_loss_and_prediction(self, input, targets, epsilon = 1e-10):
+        layers = self.compute_output_layer(input)
+        losses = - dy.log(dy.pick_batch(layers[-1], targets) + epsilon)
+        output = layers[-1].npvalue().reshape(self.dim_out, -1)
+        return losses.npvalue().reshape(-1), [int(p) for p in np.argmax(output, axis=0)]
+
+    # Matrix versions: constant inputs, a (N, dim_in) array is evaluated as one batch
+
+    def get_matrix_loss(self, X, targets, epsilon = 1e-10):
+        return self.get_batch_loss(constant_batch(X.T), targets, epsilon)
+
+    def get_matrix_loss_and_prediction(self, X, targets, epsilon = 1e-10):
+        """Losses (N,) and predicted labels (N,) for a (N, dim_in) array and N labels"""
+        layers = self.compute_output_layer(constant_batch(X.T))
+        losses = - dy.log(dy.pick_batch(layers[-1], targets) + epsilon)
+        output = layers[-1].npvalue().reshape(self.dim_out, -1)
+        return losses.npvalue().reshape(-1), np.argmax(output, axis=0)
+
 
 class MLP_sigmoid(MLP):
     def __init__(self, dim_in, dim_out, n_hidden, dim_hidden, activation, model):
@@ -132,6 +163,44 @@ class MLP_sigmoid(MLP):
         return dy.sum_elems(loss), res
 
 
+    def multi_hot(self, targets):
+        ys = np.zeros((self.dim_out, len(targets)))
+        for b, t in enumerate(targets):
+            ys[list(t), b] = 1
+        return ys
+
+    def batch_log_loss(self, output, ys, epsilon):
+        # dy.binary_log_loss does not support minibatches
+        pos = dy.cmult(constant_batch(ys), dy.log(output + epsilon))
+        neg = dy.cmult(constant_batch(1 - ys), dy.log(-output + (1 + epsilon)))
+        return - dy.sum_elems(pos + neg)
+
+    def get_batch_loss(self, input, targets, epsilon = 1e-10):
+        layers = self.compute_output_layer(input)
+        loss = self.batch_log_loss(layers[-1], self.multi_hot(targets), epsilon)
+        return dy.sum_batches(loss)
+
+    def get_batch_loss_and_prediction(self, input, targets, epsilon = 1e-10):
+        layers = self.compute_output_layer(input)
+        loss = self.batch_log_loss(layers[-1], self.multi_hot(targets), epsilon)
+        output = layers[-1].npvalue().reshape(self.dim_out, -1)
+        predictions = [{int(i) for i in np.nonzero(output[:, b] > 0.5)[0]} for b in range(output.shape[1])]
+        return loss.npvalue().reshape(-1), predictions
+
+    def get_matrix_loss(self, X, Y, epsilon = 1e-10):
+        layers = self.compute_output_layer(constant_batch(X.T))
+        if len(X) == 1:
+            # as get_loss, faster than batch_log_loss
+            return dy.sum_elems(dy.binary_log_loss(layers[-1], dy.inputTensor(Y[0].astype(np.float32))))
+        return dy.sum_batches(self.batch_log_loss(layers[-1], Y.T, epsilon))
+
+    def get_matrix_loss_and_prediction(self, X, Y, epsilon = 1e-10):
+        """Losses (N,) and multi-hot predictions (N, dim_out) for a (N, dim_in) array and multi-hot targets Y (N, dim_out)"""
+        layers = self.compute_output_layer(constant_batch(X.T))
+        loss = self.batch_log_loss(layers[-1], Y.T, epsilon)
+        output = layers[-1].npvalue().reshape(self.dim_out, -1)
+        return loss.npvalue().reshape(-1), (output.T > 0.5).astype(np.int8)
+
     def get_loss(self, input, targets, epsilon = 1e-10):
         layers = self.compute_output_layer(input)
         
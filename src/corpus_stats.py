@@ -0,0 +1,84 @@
+import os
+import pickle
+import numpy as np
+
+"""
+Corpus statistics (token, char, main label, aux label and conditional
+label counts), counted with numpy directly on the token store buffers.
+
+For a full dataset split loaded from the split cache (see dataset_cache),
+statistics are saved next to the split: {split}_stats.pkl
+"""
+
+# statistics already computed in this process
+MEMO = {}
+
+
+def count_store_tokens(store, indexes):
+    """Counts of each token type of store over examples indexes (with repetitions)"""
+    ids = np.asarray(store.ids)
+    if len(indexes) == len(store) and np.array_equal(indexes, np.arange(len(store))):
+        return np.bincount(ids, minlength=len(store.types))
+    # number of times each example of the store is in the dataset, for each of its tokens
+    weights = np.repeat(np.bincount(indexes, minlength=len(store)), np.diff(np.asarray(store.offsets)))
+    return np.bincount(ids, weights=weights, minlength=len(store.types)).astype(np.int64)
+
+
+def compute_stats(dataset):
+    labels = np.array([ex.get_label() for ex in dataset], dtype=np.int64)
+    masks = np.array([ex.aux or 0 for ex in dataset], dtype=np.int64)
+    n_labels = int(labels.max()) + 1 if len(labels) > 0 else 0
+    n_aux = int(np.bitwise_or.reduce(masks)).bit_length() if len(masks) > 0 else 0
+
+    stats = {"n": len(dataset), "tokens": {}, "chars": {}, "main": {}, "aux": {}, "cond_aux": {}}
+    main = np.bincount(labels, minlength=n_labels)
+    bits = (masks[:, None] >> np.arange(n_aux)) & 1
+    aux = bits.sum(axis=0)
+    cond_aux = np.zeros((n_aux, n_labels), dtype=np.int64)
+    for j in range(n_aux):
+        cond_aux[j] = np.bincount(labels[bits[:, j] == 1], minlength=n_labels)
+
+    # examples from different stores have different token type ids
+    stores = {}
+    for ex in dataset:
+        stores.setdefault(id(ex.store), (ex.store, []))[1].append(ex.index)
+
+    for store, indexes in stores.values():
+        tokens = count_store_tokens(store, np.array(indexes, dtype=np.int64))
+        for t in np.nonzero(tokens)[0]:
+            w = store.types[t]
+            stats["tokens"][w] = stats["tokens"].get(w, 0) + int(tokens[t])
+
+    for w, c in stats["tokens"].items():
+        for ch in w:
+            stats["chars"][ch] = stats["chars"].get(ch, 0) + c
+    stats["main"] = {l: int(main[l]) for l in range(n_labels) if main[l] > 0}
+    stats["aux"] = {j: int(aux[j]) for j in range(n_aux) if aux[j] > 0}
+    stats["cond_aux"] = {j: {l: int(cond_aux[j, l]) for l in stats["main"]} for j in stats["aux"]}
+    return stats
+
+
+def get_stats(dataset):
+    """Statistics of a dataset, read from the cache for a full cached split"""
+    stores = {id(ex.store): ex.store for ex in dataset}
+    filename = None
+    if len(stores) == 1:
+        store = list(stores.values())[0]
+        if store.cache_prefix is not None and len(store) == len(dataset):
+            filename = "{}_stats.pkl".format(store.cache_prefix)
+
+    if filename is not None and filename in MEMO:
+        return MEMO[filename]
+    if filename is not None and os.path.isfile(filename):
+        with open(filename, "rb") as ins:
+            stats = pickle.load(ins)
+    else:
+        stats = compute_stats(dataset)
+        if filename is not None:
+            tmp = "{}.{}.tmp".format(filename, os.getpid())
+            with open(tmp, "wb") as out:
+                pickle.dump(stats, out)
+            os.replace(tmp, filename)
+    if filename is not None:
+        MEMO[filename] = stats
+    return stats
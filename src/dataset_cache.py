@@ -0,0 +1,133 @@
+import os
+import sys
+import shutil
+import pickle
+import random
+import functools
+import numpy as np
+
+import example
+from example import Example, TokenStore, aux_to_mask
+
+CACHE_FOLDER = "../cache"
+SPLITS = ["train", "dev", "test"]
+
+"""
+Binary cache for the train/dev/test splits returned by the dataset readers.
+
+One folder per (corpus, arguments), containing for each split:
+    {split}_tokens.npy   int32  token type ids, all examples concatenated
+    {split}_offsets.npy  int64  example i spans tokens[offsets[i]:offsets[i+1]]
+    {split}_labels.npy   int32  main label
+    {split}_aux.npy      int64  aux labels as a bitmask (bit j set <=> j in metadata)
+    {split}_text.npy     uint8  utf8 raw texts, concatenated
+    {split}_text_offsets.npy int64
+and types.npy / types_offsets.npy (utf8 token types shared by all splits).
+random_state.pkl holds the state of the random module after the reader
+returned (readers shuffle their examples): it is restored when the splits
+are loaded from the cache, so that training sees the same random state.
+
+Arrays are loaded with mmap, so concurrent runs share the same pages.
+Delete the folder to rebuild the splits from raw files.
+"""
+
+
+def cache_folder(idcorpus, args):
+    key = "_".join([idcorpus] + [str(a) for a in args])
+    return "{}/splits_{}".format(CACHE_FOLDER, key)
+
+
+def encode_strings(strings):
+    data = [s.encode("utf8", "surrogatepass") for s in strings]
+    offsets = np.zeros(len(data) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(d) for d in data])
+    return np.frombuffer(b"".join(data), dtype=np.uint8), offsets
+
+
+def decode_strings(blob, offsets):
+    data = bytes(blob)
+    return [data[offsets[i]:offsets[i+1]].decode("utf8", "surrogatepass") for i in range(len(offsets) - 1)]
+
+
+def save_splits(folder, splits, random_state):
+    t2i = {}
+    types = []
+    tmp = "{}.{}.tmp".format(folder, os.getpid())
+    os.makedirs(tmp, exist_ok=True)
+    for name, examples in zip(SPLITS, splits):
+        ids = []
+        offsets = [0]
+        for ex in examples:
+            for t in ex.get_sentence():
+                if t not in t2i:
+                    t2i[t] = len(types)
+                    types.append(t)
+                ids.append(t2i[t])
+            offsets.append(len(ids))
+        text, text_offsets = encode_strings([ex.sentence for ex in examples])
+        np.save("{}/{}_tokens.npy".format(tmp, name), np.array(ids, dtype=np.int32))
+        np.save("{}/{}_offsets.npy".format(tmp, name), np.array(offsets, dtype=np.int64))
+        np.save("{}/{}_labels.npy".format(tmp, name), np.array([ex.get_label() for ex in examples], dtype=np.int32))
+        np.save("{}/{}_aux.npy".format(tmp, name), np.array([aux_to_mask(ex.get_aux_labels() or []) for ex in examples], dtype=np.int64))
+        np.save("{}/{}_text.npy".format(tmp, name), text)
+        np.save("{}/{}_text_offsets.npy".format(tmp, name), text_offsets)
+    blob, offsets = encode_strings(types)
+    np.save("{}/types.npy".format(tmp), blob)
+    np.save("{}/types_offsets.npy".format(tmp), offsets)
+    with open("{}/random_state.pkl".format(tmp), "wb") as out:
+        pickle.dump(random_state, out)
+    # rename at the end: a folder that exists is always complete
+    try:
+        os.rename(tmp, folder)
+    except OSError:
+        # another run wrote the same cache first
+        shutil.rmtree(tmp)
+
+
+def load_splits(folder):
+    load = lambda name: np.load("{}/{}.npy".format(folder, name), mmap_mode="r")
+    types = decode_strings(load("types"), load("types_offsets"))
+    splits = []
+    for name in SPLITS:
+        ids = load("{}_tokens".format(name))
+        offsets = load("{}_offsets".format(name))
+        labels = load("{}_labels".format(name))
+        aux = load("{}_aux".format(name))
+        texts = [None] * len(labels)
+        if example.KEEP_TEXT:
+            texts = decode_strings(load("{}_text".format(name)), load("{}_text_offsets".format(name)))
+        store = TokenStore(types, ids, offsets)
+        store.cache_prefix = "{}/{}".format(folder, name)
+        examples = [Example.from_store(store, i, int(labels[i]), int(aux[i]), texts[i]) for i in range(len(labels))]
+        splits.append(examples)
+    return tuple(splits)
+
+
+def cached(idcorpus):
+    """Decorator for a reader's get_dataset: caches its (train, dev, test) output"""
+    def decorator(get_dataset):
+        @functools.wraps(get_dataset)
+        def wrapper(*args):
+            folder = cache_folder(idcorpus, args)
+            if os.path.isdir(folder):
+                sys.stderr.write("Loading splits from {}\n".format(folder))
+                state_file = "{}/random_state.pkl".format(folder)
+                if os.path.isfile(state_file):
+                    with open(state_file, "rb") as ins:
+                        random.setstate(pickle.load(ins))
+                return load_splits(folder)
+            # raw texts are always cached, even if this run does not need them
+            keep_text = example.KEEP_TEXT
+            example.KEEP_TEXT = True
+            try:
+                splits = get_dataset(*args)
+            finally:
+                example.KEEP_TEXT = keep_text
+            os.makedirs(CACHE_FOLDER, exist_ok=True)
+            save_splits(folder, splits, random.getstate())
+            # frees the tokens of all examples built by the reader
+            example.STORE = TokenStore()
+            # reload: examples become views over the memory mapped arrays
+            return load_splits(folder)
+        return wrapper
+    return decorator
@@ -0,0 +1,46 @@
+import sys
+import time
+import importlib
+
+"""
+Dataset plugins: a dataset id maps to a reader module (with a get_dataset
+function) and to a function from command line args to get_dataset args.
+Readers are imported only when their dataset is selected, so that running
+on one dataset does not load the dependencies (nltk taggers, ...) of the
+others.
+"""
+
+DATASETS = {}
+
+# Time spent importing the reader and loading data, per dataset id
+LOAD_TIMES = {}
+
+
+def register(idcorpus, module, get_args=lambda args: ()):
+    DATASETS[idcorpus] = (module, get_args)
+
+
+def names():
+    return list(DATASETS)
+
+
+def get_dataset(idcorpus, args):
+    module_name, get_args = DATASETS[idcorpus]
+
+    start = time.time()
+    module = importlib.import_module(module_name)
+    import_time = time.time() - start
+
+    train, dev, test = module.get_dataset(*get_args(args))
+    load_time = time.time() - start - import_time
+
+    LOAD_TIMES[idcorpus] = (import_time, load_time)
+    sys.stderr.write("Dataset {}: import {} in {:.2f}s, load in {:.2f}s\n".format(idcorpus, module_name, import_time, load_time))
+    return train, dev, test
+
+
+register("ag", "ag_data_reader", lambda args: (args.num_NE,))
+register("dw", "dw_data_reader", lambda args: (args.num_NE,))
+for lang in ["fr", "de", "dk", "us", "uk"]:
+    register("tp_{}".format(lang), "trustpilot_data_reader", lambda args, lang=lang: (lang,))
+register("bl", "blog_data_reader")
@@ -2,6 +2,7 @@
 import _dynet as dy
 
 from classifier import MLP_sigmoid
+from bilstm import rnn_builder
 
 
 class Discriminator:
@@ -28,6 +29,16 @@ class Discriminator:
         
         return loss
     
+    def train_real_batch(self, input, targets):
+        loss = self.mlp.get_batch_loss(input, targets) / len(targets)
+        loss.backward()
+        self.trainer.update()
+        
+        return loss
+
+    def train_fake_batch(self, input, fake_targets):
+        return self.mlp.get_batch_loss(input, fake_targets) / len(fake_targets)
+
     def zero_gradient(self):
         for p in self.mlp.get_parameter_list():
             p.scale_gradient(0)
@@ -49,13 +60,19 @@ class Generator:
         #    self.voc_size = vocabulary.size_words()
         
         self.lu = model.add_lookup_parameters((self.voc_size, self.dim_embeddings))
-        self.lstm = dy.LSTMBuilder(1, self.dim_embeddings, self.dim_lstm, model)
+        self.lstm = rnn_builder(args.cell, self.dim_embeddings, self.dim_lstm, model)
         
         self.h2o = model.add_parameters((self.voc_size, self.dim_lstm))
         self.b  = model.add_parameters((self.voc_size))
     
+    def initial_vectors(self, input):
+        # LSTMs: memory cell and output, GRU: output only
+        if isinstance(self.lstm, dy.GRUBuilder):
+            return [input]
+        return [input, dy.zeros(self.dim_lstm)]
+
     def train_real(self, input, targets, epsilon = 1e-10):
-        init_states = [input, dy.zeros(self.dim_lstm)]
+        init_states = self.initial_vectors(input)
         
         state = self.lstm.initial_state(init_states)
 
@@ -77,7 +94,7 @@ class Generator:
         return loss
 
     def train_fake(self, input, targets, epsilon = 1e-10):
-        init_states = [input, dy.zeros(self.dim_lstm)]
+        init_states = self.initial_vectors(input)
         
         state = self.lstm.initial_state(init_states)
 
@@ -7,12 +7,16 @@ random.seed(10)
 from collections import defaultdict
 
 import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 import xml.etree.ElementTree as ET
 from xml.sax.saxutils import unescape
 from nltk import Tree
 from pprint import pprint
 
 import ner
+import tokenization
+import dataset_cache
 from example import Example
 
 CLA_FRE = {'Germany': 6837, 'Europe': 5789, 'Business': 3725, 'Culture': 1907, 'Sports': 1246,
@@ -30,38 +34,99 @@ CLASSES_MAP = {c: i for i, c in enumerate(CLASSES)}
 
 
 
-def read_one_json(filename):
+def parse_one_json(filename):
+    """Returns (text, category name), text is None for unusable documents"""
     with open(filename) as json_data:
         d = json.load(json_data)
-        json_data.close()
         #text = d['teaser']
-        try:
-            if "text" not in d or len(d["text"].strip().split()) == 0:
-                return None
-            text = d['text']
-            if d["categoryName"] in CLASSES_MAP:
-                label = CLASSES_MAP[d["categoryName"]]
-            #elif train:
-                #label = len(cmap)
-                #cmap[d["categoryName"]] = label
-            else:
-                return None
-            example = Example(text, label)
-            return example
-        except KeyError:
+        if "text" not in d or len(d["text"].strip().split()) == 0:
+            return None, d.get("categoryName")
+        if "categoryName" not in d:
             pprint(d)
-            
-    
-def read_from_folder(folder):
-    corpus = []
+            return None, None
+        return d['text'], d["categoryName"]
 
-    for filename in os.listdir(folder):
-        if filename.endswith(".json"):
-            f = "{}/{}".format(folder, filename)
-            example = read_one_json(f)
-            if example is None:
-                continue
-            corpus.append(example)
+def read_one_json(filename):
+    text, category = parse_one_json(filename)
+    if text is None or category not in CLASSES_MAP:
+        return None
+    return text, CLASSES_MAP[category]
+
+
+"""
+Manifest index for a json folder: one line per json file
+    filename  mtime_ns  category  offset  length
+where [offset, offset+length) is the utf8 text in a packed store (offset=-1
+if the file has no text). Unchanged files are then read with a single
+sequential read of the packed store instead of one open/parse per file.
+"""
+
+def manifest_prefix(folder):
+    key = hashlib.sha1(os.path.abspath(folder).encode("utf8")).hexdigest()[:16]
+    return "{}/dw_{}".format(tokenization.CACHE_FOLDER, key)
+
+def load_manifest(folder):
+    prefix = manifest_prefix(folder)
+    if not os.path.isfile("{}.manifest".format(prefix)):
+        return {}
+    with open("{}.pack".format(prefix), "rb") as ins:
+        pack = ins.read()
+    entries = {}
+    for line in open("{}.manifest".format(prefix), encoding="utf8"):
+        filename, mtime, category, offset, length = line.rstrip("\n").split("\t")
+        offset, length = int(offset), int(length)
+        text = None if offset < 0 else pack[offset:offset+length].decode("utf8")
+        entries[filename] = (int(mtime), text, category if category else None)
+    return entries
+
+def save_manifest(folder, entries):
+    os.makedirs(tokenization.CACHE_FOLDER, exist_ok=True)
+    prefix = manifest_prefix(folder)
+    tmp = "{}.{}.tmp".format(prefix, os.getpid())
+    manifest = open("{}.manifest".format(tmp), "w", encoding="utf8")
+    pack = open("{}.pack".format(tmp), "wb")
+    offset = 0
+    for filename in sorted(entries):
+        mtime, text, category = entries[filename]
+        if text is None:
+            manifest.write("{}\t{}\t{}\t-1\t0\n".format(filename, mtime, category or ""))
+        else:
+            data = text.encode("utf8")
+            pack.write(data)
+            manifest.write("{}\t{}\t{}\t{}\t{}\n".format(filename, mtime, category or "", offset, len(data)))
+            offset += len(data)
+    manifest.close()
+    pack.close()
+    os.replace("{}.pack".format(tmp), "{}.pack".format(prefix))
+    os.replace("{}.manifest".format(tmp), "{}.manifest".format(prefix))
+
+def read_from_folder(folder, idcorpus="dw_corpus", n_threads=16):
+    manifest = load_manifest(folder)
+    
+    files = {e.name: e.stat().st_mtime_ns for e in os.scandir(folder) if e.name.endswith(".json")}
+    todo = sorted(f for f in files if f not in manifest or manifest[f][0] != files[f])
+    
+    if len(todo) > 0 or len(manifest) != len(files):
+        sys.stderr.write("Reading {} json files from {}\n".format(len(todo), folder))
+        with ThreadPoolExecutor(n_threads) as executor:
+            parsed = executor.map(parse_one_json, ["{}/{}".format(folder, f) for f in todo])
+            for filename, (text, category) in zip(todo, parsed):
+                manifest[filename] = (files[filename], text, category)
+        manifest = {f: manifest[f] for f in files}
+        save_manifest(folder, manifest)
+    
+    records = []
+    # sorted, not listdir order: the corpus order no longer depends on the file
+    # system. Caches aligned with the corpus by line (../tools/ner_dw_corpus from
+    # before this change) do not match this order any more
+    for filename in sorted(files):
+        _, text, category = manifest[filename]
+        if text is None or category not in CLASSES_MAP:
+            continue
+        records.append((text, CLASSES_MAP[category]))
+
+    tokens = tokenization.tokenize_all([text for text, _ in records], idcorpus)
+    corpus = [Example(text, label, tokens=toks) for (text, label), toks in zip(records, tokens)]
 
     # Sort classes by frequency
     #cats = sorted(categories_map, key = lambda x : categories_map[x])
@@ -76,6 +141,7 @@ def read_from_folder(folder):
     return corpus
     
 
+@dataset_cache.cached("dw")
 def get_dataset(k=10):
     folder="../datasets/en_corpora_sets/{}/json/"
     train_dir = folder.format("train")
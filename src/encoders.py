@@ -0,0 +1,100 @@
+import _dynet as dy
+import numpy as np
+
+from bilstm import HierarchicalBiLSTM, ChunkedBiLSTM
+
+"""
+Sentence encoders. All of them have the interface of HierarchicalBiLSTM:
+build_representations, build_batch_representations, size, set_dropout
+and disable_dropout, and use its static (word + char LSTM) embeddings.
+
+The pooled encoders below do not read sentences sequentially, they are
+faster than the LSTM (for quick sweeps) and have dim_wrnn outputs.
+"""
+
+
+class PooledEncoder(HierarchicalBiLSTM):
+    """Static embeddings of the prefix and the sentence, pooled into one vector"""
+
+    def build_word_level(self, args, model):
+        self.wrnn = []
+        self._size = args.dim_wrnn
+        self.dropout = 0
+        self.build_pooling(args, model)
+
+    def build_representations(self, example, training, prefix = [], do_not_renew=False, token_outputs=False):
+        # no token outputs
+        return self.build_batch_representations([example], training, [prefix], do_not_renew), None
+
+    def encode_batch(self, forward, prefix_lengths):
+        if self.crnn is not None:
+            self.get_char_encodings([token[1] for c in forward for token in c])
+        static = [self.get_static_representations(c) for c in forward]
+        output = self.pool(static)
+        if self.dropout > 0:
+            output = dy.dropout(output, self.dropout)
+        return output
+
+    def set_dropout(self, v):
+        super().set_dropout(v)
+        self.dropout = v
+
+    def disable_dropout(self):
+        super().disable_dropout()
+        self.dropout = 0
+
+
+class BagOfEmbeddings(PooledEncoder):
+    """Mean of the static embeddings, then a tanh layer"""
+
+    def build_pooling(self, args, model):
+        self.W = model.add_parameters((args.dim_wrnn, self.dim_input))
+        self.b = model.add_parameters((args.dim_wrnn,))
+
+    def pool(self, static):
+        mean = dy.concatenate_to_batch([dy.average(s) for s in static])
+        return dy.tanh(self.W * mean + self.b)
+
+
+class ConvEncoder(PooledEncoder):
+    """1D convolution (dim_wrnn filters of cnn_window tokens, ReLU), max-pooled over positions.
+
+    Sequences are padded with cnn_window - 1 zero vectors on both sides:
+    every window contains at least one token.
+    """
+
+    def build_pooling(self, args, model):
+        self.window = args.cnn_window
+        # the filters of all the positions of a window, one matrix product per batch
+        self.W = model.add_parameters((args.dim_wrnn, self.dim_input * self.window))
+        self.b = model.add_parameters((args.dim_wrnn,))
+
+    def pool(self, static):
+        length = max(len(s) for s in static) + 2 * (self.window - 1)
+        n_windows = length - self.window + 1
+        zeros = [dy.zeros(self.dim_input)] * (self.window - 1)
+        steps = self.pad_batch([zeros + s + zeros for s in static])
+        # column i: the window starting at position i, (dim_input * window, n_windows)
+        windows = dy.concatenate([dy.concatenate_cols(steps[j:j+n_windows]) for j in range(self.window)])
+        output = dy.rectify(dy.colwise_add(self.W * windows, self.b))
+        if len(static) > 1:
+            # windows after the end of a shorter sequence are set to 0,
+            # which does not change the max of non negative values
+            mask = np.zeros((1, n_windows, len(static)))
+            for b, s in enumerate(static):
+                mask[0, :len(s) + self.window - 1, b] = 1
+            # outer product with ones: much faster than a broadcast cmult
+            mask = dy.ones((self._size, 1)) * dy.inputTensor(mask, batched=True)
+            output = dy.cmult(output, mask)
+        return dy.max_dim(output, d = 1)
+
+
+ENCODERS = {"lstm": HierarchicalBiLSTM,
+            "boe": BagOfEmbeddings,
+            "cnn": ConvEncoder}
+
+
+def get_encoder(args, vocabulary, model):
+    if args.encoder == "lstm" and args.chunk_size is not None:
+        return ChunkedBiLSTM(args, vocabulary, model)
+    return ENCODERS[args.encoder](args, vocabulary, model)
@@ -1,37 +1,118 @@
-
 import nltk.tokenize as tokenizer
+from array import array
+
+# Keep raw texts in memory (only needed by the generator defense)
+KEEP_TEXT = True
+
+
+def aux_to_mask(aux):
+    mask = 0
+    for a in aux:
+        mask |= 1 << a
+    return mask
+
+
+def mask_to_aux(mask):
+    return {i for i in range(mask.bit_length()) if (mask >> i) & 1}
+
+
+class TokenStore:
+    """Tokens of a corpus as ids in shared flat buffers.
+
+    Example i spans ids[offsets[i]:offsets[i+1]], ids index self.types.
+    Buffers are arrays, or numpy (memory mapped) arrays for cached splits.
+    """
+    def __init__(self, types=None, ids=None, offsets=None):
+        self.types = types if types is not None else []
+        self.t2i = None
+        self.ids = ids if ids is not None else array("i")
+        self.offsets = offsets if offsets is not None else array("q", [0])
+        # set for splits loaded from the cache (see dataset_cache)
+        self.cache_prefix = None
+
+    def add(self, tokens):
+        if self.t2i is None:
+            self.t2i = {t: i for i, t in enumerate(self.types)}
+        for t in tokens:
+            if t not in self.t2i:
+                self.t2i[t] = len(self.types)
+                self.types.append(t)
+            self.ids.append(self.t2i[t])
+        self.offsets.append(len(self.ids))
+        return len(self.offsets) - 2
+
+    def get_ids(self, index):
+        return self.ids[self.offsets[index]:self.offsets[index+1]]
+
+    def get_tokens(self, index):
+        types = self.types
+        return [types[t] for t in self.get_ids(index)]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+# Store for examples built by the readers
+STORE = TokenStore()
 
 
 class Example:
-    def __init__(self, sentence, label, metadata = None):
-        self.sentence = sentence
+    __slots__ = ["store", "index", "label", "aux", "text"]
+
+    def __init__(self, sentence, label, metadata = None, tokens = None):
+        if tokens is None:
+            tokens = tokenizer.word_tokenize(sentence)
+        self.store = STORE
+        self.index = STORE.add(tokens)
         self.label = label
-        
-        self.p_sentence = tokenizer.word_tokenize(sentence)
-        
         self.metadata = metadata
-    
+        self.text = sentence if KEEP_TEXT else None
+
+    @classmethod
+    def from_store(cls, store, index, label, aux, text=None):
+        ex = cls.__new__(cls)
+        ex.store = store
+        ex.index = index
+        ex.label = label
+        ex.aux = aux
+        ex.text = text
+        return ex
+
+    @property
+    def sentence(self):
+        return self.text
+
+    @property
+    def p_sentence(self):
+        return self.store.get_tokens(self.index)
+
+    @property
+    def metadata(self):
+        if self.aux is None:
+            return None
+        return mask_to_aux(self.aux)
+
+    @metadata.setter
+    def metadata(self, meta):
+        self.aux = None if meta is None else aux_to_mask(meta)
+
     def get_label(self):
         return self.label
-    
+
     def get_sentence(self):
         return self.p_sentence
-    
-    def get_aux_labels(self):
-        return self.metadata
-    
-    
-    
-    
-    def get_training_example(self):
-        return self.p_sentence, self.label
-    
-    def get_aux_training(self):
-        return self.p_sentence, self.metadata
 
+    def get_token_ids(self):
+        return self.store.get_ids(self.index)
 
+    def get_aux_labels(self):
+        return self.metadata
 
 
 
 
+    def get_training_example(self):
+        return self.p_sentence, self.label
 
+    def get_aux_training(self):
+        return self.p_sentence, self.metadata
@@ -4,6 +4,9 @@ from joblib import Parallel, delayed
 import os
 import subprocess
 
+import dataset_registry
+import backend
+
 
 def generate_command_lines(args):
     
@@ -22,6 +25,13 @@ def generate_command_lines(args):
             if not args.data.startswith("tp") and not args.data.startswith("bl"):
                 others += " -k {} ".format(args.num_NE)
             
+            if args.encoder != "lstm":
+                others += " --encoder {} ".format(args.encoder)
+            if args.cell != "vanilla":
+                others += " --cell {} ".format(args.cell)
+            if args.adversary_batch_size != 1:
+                others += " --adversary-batch-size {} ".format(args.adversary_batch_size)
+            
             
             options_all = options_tpl.format(ds=args.dynet_seed, i=args.iterations, I=args.iterations_adv, L=L, l=l, w=w, W=W, D=others)
             
@@ -33,8 +43,9 @@ def generate_command_lines(args):
                 
                 output = "{}/{}".format(args.output, options.replace(" ", "_").replace("-", "_"))
                 
-                command_line = "python main.py {output} {dataset} {options} > {output}_log"
-                command_line = command_line.format(output=output, dataset=args.data, options=options)
+                # the profile does not change results: not part of the output name
+                command_line = "python main.py {output} {dataset} {options} --profile {profile} > {output}_log"
+                command_line = command_line.format(output=output, dataset=args.data, options=options, profile=args.profile)
                 
                 yield command_line
 
@@ -57,11 +68,12 @@ if __name__ == "__main__":
     
     parser = argparse.ArgumentParser(description = usage, formatter_class=argparse.RawTextHelpFormatter)
     
-    parser.add_argument("data", type=str, choices=["ag", "dw", "tp_fr", "tp_de", "tp_dk", "tp_us", "tp_uk", "bl"], help="dataset")
+    parser.add_argument("data", type=str, choices=dataset_registry.names(), help="dataset")
     parser.add_argument("output", type=str, help="output folder")
     
     parser.add_argument("--iterations", "-i", type=int, default=10, help="Number of iterations per experiment")
     parser.add_argument("--iterations-adv", "-I", type=int, default=20, help="Number of iterations for attacker")
+    parser.add_argument("--adversary-batch-size", type=int, default=1, help="Minibatch size of the attacker")
     parser.add_argument("--threads", "-N", type=int, default=1, help="Max number of experiments in parallel")
     
     parser.add_argument("--hidden-layers", "-L", type=int, nargs="+", default=[2], help="Number of hidden layers")
@@ -70,13 +82,17 @@ if __name__ == "__main__":
     parser.add_argument("--dim-word","-w", type=int, nargs="+", default=[32], help="Dimension of word embeddings")
     parser.add_argument("--dim-wrnn","-W", type=int, nargs="+", default=[32], help="Dimension of word lstm")
     
+    parser.add_argument("--encoder", choices=["lstm", "boe", "cnn"], default="lstm", help="Sentence encoder")
+    parser.add_argument("--cell", choices=["vanilla", "compact", "gru"], default="vanilla", help="RNN cell")
+    
     parser.add_argument("--use-demographics", "-D", action="store_true", help="use demographic variables as input to bi-lstm")
     
     parser.add_argument("--num-NE", "-k", type=int, default=4, help="Number of named entities")
     
     parser.add_argument("--alpha", type=float, nargs="+", default=[0.1], help="scaling value for anti adversary loss")
     
-    parser.add_argument("--dynet-seed", type=int, default=4 , help="random seed for dynet (needs to be first argument!)")
+    parser.add_argument("--dynet-seed", type=int, default=4 , help="random seed for dynet")
+    parser.add_argument("--profile", choices=list(backend.PROFILES), default="debug", help="Dynet runtime profile (see backend.py)")
     
     args = parser.parse_args()
     
@@ -1,20 +1,13 @@
 
 from collections import defaultdict
 import sys
-import _dynet as dy
+import random
+import numpy as np
 
-import imdb_data_reader
-import trustpilot_data_reader
-import ag_data_reader
-import dw_data_reader
-import blog_data_reader
-
-from classifier import MLP, MLP_sigmoid
-from example import Example
-from bilstm import HierarchicalBiLSTM
-from vocabulary import Vocabulary, TypedEncoder
-import vocabulary
-from discriminator import Discriminator, Generator
+import dataset_registry
+import corpus_stats
+import backend
+from vocabulary import Vocabulary
 
 def compute_conditional_baseline(cond_aux, main):
     results = []
@@ -29,19 +22,12 @@ def compute_conditional_baseline(cond_aux, main):
     return results
 
 def print_data_distributions(dataset):
-    main = defaultdict(int)
-    aux = defaultdict(int)
-    
-    cond_aux = defaultdict(lambda:defaultdict(int))
+    stats = corpus_stats.get_stats(dataset)
+    main = stats["main"]
+    aux = stats["aux"]
+    cond_aux = stats["cond_aux"]
     
-    total = len(dataset)
-    for example in dataset:
-        label = example.get_label()
-        main[label] += 1
-        meta = example.get_aux_labels()
-        for caracteristic in meta:
-            aux[caracteristic] += 1
-            cond_aux[caracteristic][label] += 1
+    total = stats["n"]
     
     d_main = np.array(list(main.values()))
     d_aux  = np.array(list(aux.values()))
@@ -63,22 +49,19 @@ def print_data_distributions(dataset):
 
 
 def get_demographics_prefix(example):
+    from trustpilot_data_reader import GENDER, BIRTH
     aux = example.get_aux_labels()
-    gen = "F" if trustpilot_data_reader.GENDER in aux else "M"
-    age = "O" if trustpilot_data_reader.BIRTH in aux else "U"
+    gen = "F" if GENDER in aux else "M"
+    age = "O" if BIRTH in aux else "U"
     return ["<g={}>".format(gen), "<a={}>".format(age)]
 
 
-def extract_vocabulary(dataset, add_symbols=None):
-    freqs = defaultdict(int)
-    for example in dataset:
-        s = example.get_sentence()
-        for token in s:
-            freqs[token] += 1
+def extract_vocabulary(dataset, add_symbols=None, min_freq=1, max_size=None, n_buckets=0):
+    freqs = defaultdict(int, corpus_stats.get_stats(dataset)["tokens"])
     if add_symbols is not None:
         for s in add_symbols:
             freqs[s] += 1000
-    return Vocabulary(freqs)
+    return Vocabulary(freqs, min_freq, max_size, n_buckets)
 
 def get_aux_labels(examples):
     labels = set()
@@ -88,6 +71,11 @@ def get_aux_labels(examples):
     return labels
 
 
+def label_sets(multi_hot):
+    # rows of a multi-hot matrix as sets of labels
+    return [set(np.nonzero(row)[0].tolist()) for row in multi_hot]
+
+
 def compute_eval_metrics(n_tasks, gold, predictions):
     tp = 0
     all_pred = 0
@@ -124,6 +112,28 @@ def compute_eval_metrics(n_tasks, gold, predictions):
     
     return p, r, f, acc_all
 
+def make_batches(dataset, batch_size, shuffle=True, bucket_size=50):
+    """Minibatches of examples of similar lengths, as lists of indexes.
+
+    Examples are sorted by length within chunks of bucket_size batches
+    (random chunks if shuffle) and batches are returned in random order.
+    """
+    order = list(range(len(dataset)))
+    if batch_size == 1:
+        return [[i] for i in order]
+    if shuffle:
+        random.shuffle(order)
+    else:
+        bucket_size = len(dataset)
+    chunk_size = batch_size * bucket_size
+    batches = []
+    for i in range(0, len(order), chunk_size):
+        chunk = sorted(order[i:i+chunk_size], key = lambda j: len(dataset[j].get_token_ids()))
+        batches.extend([chunk[k:k+batch_size] for k in range(0, len(chunk), batch_size)])
+    if shuffle:
+        random.shuffle(batches)
+    return batches
+
 class PrModel:
     
     def __init__(self, args, model, trainer, bilstm, main_classifier, adversary_classifier, discriminator, generator, voc):
@@ -145,7 +155,7 @@ class PrModel:
 
     def _get_input(self, example, training, do_not_renew, backprop):
         prefix = get_demographics_prefix(example) if self.args.use_demographics else []
-        encoding, _ = self.bilstm.build_representations(example.get_sentence(), training=training, prefix = prefix, do_not_renew=do_not_renew)
+        encoding, _ = self.bilstm.build_representations(example, training=training, prefix = prefix, do_not_renew=do_not_renew)
         return encoding
 
     def get_input(self, example, training, do_not_renew=False, backprop=True):
@@ -155,6 +165,14 @@ class PrModel:
         else:
             return dy.nobackprop(encoding)
 
+    def get_batch_input(self, examples, training, do_not_renew=False, backprop=True):
+        prefixes = [get_demographics_prefix(ex) for ex in examples] if self.args.use_demographics else None
+        encoding = self.bilstm.build_batch_representations(examples, training=training, prefixes=prefixes, do_not_renew=do_not_renew)
+        if backprop:
+            return encoding
+        else:
+            return dy.nobackprop(encoding)
+
     #def train_one(self, example, target, classifier):
         #input_vec = self.get_input(example, training=True, backprop=not self.adversary)
         #loss = classifier.get_loss(input_vec, target)
@@ -191,6 +209,21 @@ class PrModel:
 
         self.trainer.update()
 
+    def privacy_train_batch(self, batch, train):
+
+        sampled = [train[i] for i in np.random.randint(len(train), size=len(batch))]
+        
+        input_e1 = self.get_batch_input(batch, training=True, do_not_renew=False, backprop=True)
+        input_e2 = self.get_batch_input(sampled, training=True, do_not_renew=True, backprop=True)
+        
+        weights = [0.5 - self.compute_hamming(e1, e2) for e1, e2 in zip(batch, sampled)]
+        weights = dy.inputTensor(weights, batched=True)
+        
+        loss = dy.sum_batches(dy.cmult(weights, dy.squared_norm(input_e1 - input_e2))) * (self.args.alpha / len(batch))
+        loss.backward()
+
+        self.trainer.update()
+
     def discriminator_train(self, example):
 
         real_labels = example.get_aux_labels()
@@ -210,6 +243,25 @@ class PrModel:
         
         return real_loss.value()
 
+    def discriminator_train_batch(self, batch):
+
+        n_labels = self.adversary_classifier.output_size()
+        real_labels = [ex.get_aux_labels() for ex in batch]
+        fake_labels = [set([i for i in range(n_labels) if i not in labels]) for labels in real_labels]
+        
+        input = self.get_batch_input(batch, training=True, do_not_renew=False, backprop=True)
+        input_noback = dy.nobackprop(input)
+        
+        real_loss = self.discriminator.train_real_batch(input_noback, real_labels)
+        fake_loss = self.discriminator.train_fake_batch(input, fake_labels)
+        fake_loss.backward()
+        
+        self.discriminator.zero_gradient()
+        
+        self.trainer.update()
+        
+        return real_loss.value() * len(batch)
+
     def generator_train(self, example):
 
         text = example.sentence
@@ -235,6 +287,10 @@ class PrModel:
         tot = len(dataset)
         assert(len(targets) == len(dataset))
         self.bilstm.disable_dropout()
+        if self.use_numpy():
+            return self.evaluate_main_numpy(dataset, targets)
+        if self.args.batch_size > 1:
+            return self.evaluate_main_batch(dataset, targets)
         predictions = []
         for i, ex in enumerate(dataset):
             #l, p = self.predict(ex, targets[i], self.main_classifier)
@@ -249,6 +305,100 @@ class PrModel:
             loss += l.value()
         return loss / tot, acc / tot * 100, predictions
 
+    def evaluate_main_batch(self, dataset, targets):
+        loss = 0
+        acc = 0
+        tot = len(dataset)
+        predictions = [None] * tot
+        for batch in make_batches(dataset, self.args.batch_size, shuffle=False):
+            input_vec = self.get_batch_input([dataset[i] for i in batch], training=False)
+            losses, preds = self.main_classifier.get_batch_loss_and_prediction(input_vec, [targets[i] for i in batch])
+            for i, p in zip(batch, preds):
+                predictions[i] = p
+                if p == targets[i]:
+                    acc += 1
+            loss += losses.sum()
+        return loss / tot, acc / tot * 100, predictions
+
+    def use_numpy(self):
+        # the numpy engine only implements the (non chunked) vanilla LSTM encoder
+        return self.args.numpy_inference and self.args.encoder == "lstm" and self.args.cell == "vanilla" and self.args.chunk_size is None
+
+    def get_numpy_inputs(self, dataset, training, batch_size=256):
+        """Encodes a dataset with the numpy engine, yields (batch indexes, (batch, dim) array)"""
+        encoder = NumpyEncoder(self.bilstm)
+        for batch in make_batches(dataset, batch_size, shuffle=False):
+            examples = [dataset[i] for i in batch]
+            prefixes = [get_demographics_prefix(ex) for ex in examples] if self.args.use_demographics else None
+            yield batch, encoder.encode(examples, training, prefixes)
+
+    def evaluate_main_numpy(self, dataset, targets):
+        loss = 0
+        acc = 0
+        tot = len(dataset)
+        predictions = [None] * tot
+        classifier = NumpyMLP(self.main_classifier)
+        for batch, X in self.get_numpy_inputs(dataset, training=False):
+            losses, preds = classifier.get_loss_and_prediction(X, [targets[i] for i in batch])
+            for i, p in zip(batch, preds):
+                predictions[i] = p
+                if p == targets[i]:
+                    acc += 1
+            loss += losses.sum()
+        return loss / tot, acc / tot * 100, predictions
+
+    def train_main_example(self, example, train, lr, n_updates):
+        discriminator_loss = 0
+        generator_loss = 0
+        
+        #self.train_one(example, get_label(example), classifier)
+        #def train_one(self, example, target, classifier):
+        target = example.get_label()
+        input_vec = self.get_input(example, training=True, backprop=True)
+        loss = self.main_classifier.get_loss(input_vec, target)
+        loss.backward()
+        self.trainer.update()
+
+        # learning rate decay
+        self.trainer.learning_rate = lr / (1 + n_updates * self.args.decay_constant)
+        
+        if self.args.ptraining:
+            self.privacy_train(example, train)
+        
+        if self.args.atraining:
+            discriminator_loss += self.discriminator_train(example)
+        
+        if self.args.generator:
+            generator_loss += self.generator_train(example)
+        
+        return discriminator_loss, generator_loss
+
+    def train_main_batch(self, batch, train, lr, n_updates):
+        discriminator_loss = 0
+        generator_loss = 0
+        
+        targets = [example.get_label() for example in batch]
+        input_vec = self.get_batch_input(batch, training=True, backprop=True)
+        loss = self.main_classifier.get_batch_loss(input_vec, targets) / len(batch)
+        loss.backward()
+        self.trainer.update()
+
+        # learning rate decay
+        self.trainer.learning_rate = lr / (1 + n_updates * self.args.decay_constant)
+        
+        if self.args.ptraining:
+            self.privacy_train_batch(batch, train)
+        
+        if self.args.atraining:
+            discriminator_loss += self.discriminator_train_batch(batch)
+        
+        if self.args.generator:
+            # sequences of chars of different lengths: one example at a time
+            for example in batch:
+                generator_loss += self.generator_train(example)
+        
+        return discriminator_loss, generator_loss
+
     def train_main(self, train, dev):
         
         lr = self.args.learning_rate
@@ -269,30 +419,18 @@ class PrModel:
             
             discriminator_loss = 0
             generator_loss = 0
-            for i, example in enumerate(train):
+            batches = make_batches(train, self.args.batch_size)
+            for i, batch in enumerate(batches):
                 
                 try: 
-                    sys.stderr.write("\r{}%".format(i / len(train) * 100))
+                    sys.stderr.write("\r{}%".format(i / len(batches) * 100))
                     
-                    #self.train_one(example, get_label(example), classifier)
-                    #def train_one(self, example, target, classifier):
-                    target = example.get_label()
-                    input_vec = self.get_input(example, training=True, backprop=True)
-                    loss = self.main_classifier.get_loss(input_vec, target)
-                    loss.backward()
-                    self.trainer.update()
-
-                    # learning rate decay
-                    self.trainer.learning_rate = lr / (1 + n_updates * dc)
-                    
-                    if self.args.ptraining:
-                        self.privacy_train(example, train)
-                    
-                    if self.args.atraining:
-                        discriminator_loss += self.discriminator_train(example)
-                    
-                    if self.args.generator:
-                        generator_loss += self.generator_train(example)
+                    if len(batch) == 1:
+                        d_loss, g_loss = self.train_main_example(train[batch[0]], train, lr, n_updates)
+                    else:
+                        d_loss, g_loss = self.train_main_batch([train[j] for j in batch], train, lr, n_updates)
+                    discriminator_loss += d_loss
+                    generator_loss += g_loss
                     
                     n_updates += 1
                 except:
@@ -334,6 +472,7 @@ class PrModel:
         
         if self.args.iterations > 0:
             self.model.populate("{}/main_model{}".format(self.output_folder, ibest))
+            self.bilstm.reset_char_table()
         return best
 
     #def train_main(self, train, dev):
@@ -345,64 +484,66 @@ class PrModel:
         #return self._train(train, dev, self.args.iterations_adversary, self.adversary_classifier, get_label, True)
 
     def get_adversary_dataset(self, data):
+        """Hidden vectors (N, size) and multi-hot private labels (N, n_labels) of a dataset"""
         self.bilstm.disable_dropout()
-        vectors = []
-        for ex in data:
-            input_vec = self.get_input(ex, training=True, backprop=False)
-            
-            pair = (input_vec.value(), ex.get_aux_labels())
-            vectors.append(pair)
-        return vectors
+        X = np.zeros((len(data), self.bilstm.size()), dtype=np.float32)
+        if self.use_numpy():
+            for batch, vectors in self.get_numpy_inputs(data, training=True):
+                X[batch] = vectors
+        elif self.args.batch_size > 1:
+            for batch in make_batches(data, self.args.batch_size, shuffle=False):
+                input_vec = self.get_batch_input([data[i] for i in batch], training=True, backprop=False)
+                X[batch] = input_vec.npvalue().reshape(self.bilstm.size(), -1).T
+        else:
+            for i, ex in enumerate(data):
+                X[i] = self.get_input(ex, training=True, backprop=False).npvalue()
+        Y = self.adversary_classifier.multi_hot([ex.get_aux_labels() for ex in data]).T.astype(np.int8)
+        return X, Y
     
     def evaluate_adversary(self, dataset):
-        loss = 0
-        acc = 0
-        tot = len(dataset)
+        # the hidden vectors are constants: the whole dataset is evaluated as one batch
+        X, Y = dataset
+        tot = len(X)
         
-        predictions = []
-        for i, ex in enumerate(dataset):
-            
-            dy.renew_cg()
-            vec, labels = ex
-            vec = dy.inputVector(vec)
-            
-            l, p = self.adversary_classifier.get_loss_and_prediction(vec, labels)
-            
-            predictions.append(p)
-            if p == labels:
-                acc += 1
-            loss += l.value()
-
-        return loss / tot, acc / tot * 100, predictions
+        backend.renew_cg()
+        losses, multi_hot = self.adversary_classifier.get_matrix_loss_and_prediction(X, Y)
+        
+        predictions = label_sets(multi_hot)
+        acc = int((multi_hot == Y).all(axis=1).sum())
+        return losses.sum() / tot, acc / tot * 100, predictions
 
     
     def train_adversary(self, train, dev):
         lr = self.args.learning_rate
         dc = self.args.decay_constant
         
-        random.shuffle(train)
-        sample_train = train[:len(dev)]
+        # index permutation, shuffled as the list of examples used to be
+        X, Y = train
+        order = list(range(len(X)))
+        random.shuffle(order)
+        sample = order[:len(dev[0])]
+        sample_train = X[sample], Y[sample]
         self.trainer.learning_rate = lr
         
         epochs = self.args.iterations_adversary
+        batch_size = self.args.adversary_batch_size
         
         n_updates = 0
         best = 0
         ibest=0
         
         for epoch in range(self.args.iterations_adversary):
-            random.shuffle(train)
+            random.shuffle(order)
             
-            for i, example in enumerate(train):
+            for i in range(0, len(order), batch_size):
                 
-                dy.renew_cg()
+                backend.renew_cg()
                 
-                vec, label = example
-                vec = dy.inputVector(vec)
+                batch = order[i:i+batch_size]
                 
-                sys.stderr.write("\r{}%".format(i / len(train) * 100))
+                sys.stderr.write("\r{}%".format(i / len(order) * 100))
                 
-                loss = self.adversary_classifier.get_loss(vec, label)
+                loss = self.adversary_classifier.get_matrix_loss(X[batch], Y[batch]) / len(batch)
                 loss.backward()
                 self.trainer.update()
                 self.trainer.learning_rate = lr / (1 + n_updates * dc)
@@ -412,8 +553,8 @@ class PrModel:
             sys.stderr.write("\r")
             
             
-            targets_t = [label for _, label in sample_train]
-            targets_d = [label for _, label in dev]
+            targets_t = label_sets(sample_train[1])
+            targets_d = label_sets(dev[1])
             
             loss_t, acc_t, predictions_t = self.evaluate_adversary(sample_train)
             loss_d, acc_d, predictions_d = self.evaluate_adversary(dev)
@@ -440,6 +581,7 @@ class PrModel:
         
         if epochs > 0:
             self.model.populate("{}/adverse_model{}".format(self.output_folder, ibest))
+            self.bilstm.reset_char_table()
         
         return best
 
@@ -461,15 +603,24 @@ class PrModel:
             random.shuffle(train)
             self.bilstm.set_dropout(0.2)
             
-            for i, example in enumerate(train):
-                sys.stderr.write("\r{}%".format(i / len(train) * 100))
+            batches = make_batches(train, self.args.batch_size)
+            for i, batch in enumerate(batches):
+                sys.stderr.write("\r{}%".format(i / len(batches) * 100))
                 
                 try:
-                    #self.train_one(example, example.get_aux_labels(), classifier)
-                    target = example.get_aux_labels()
-                    
-                    input_vec = self.get_input(example, training=True, backprop=True, do_not_renew = False)
-                    loss = self.adversary_classifier.get_loss(input_vec, target)
+                    if len(batch) == 1:
+                        #self.train_one(example, example.get_aux_labels(), classifier)
+                        example = train[batch[0]]
+                        target = example.get_aux_labels()
+                        
+                        input_vec = self.get_input(example, training=True, backprop=True, do_not_renew = False)
+                        loss = self.adversary_classifier.get_loss(input_vec, target)
+                    else:
+                        examples = [train[j] for j in batch]
+                        targets = [ex.get_aux_labels() for ex in examples]
+                        
+                        input_vec = self.get_batch_input(examples, training=True, backprop=True, do_not_renew = False)
+                        loss = self.adversary_classifier.get_batch_loss(input_vec, targets) / len(batch)
                     loss.backward()
                     self.trainer.update()
 
@@ -509,6 +660,7 @@ class PrModel:
         
         if epochs > 0:
             self.model.populate("{}/_baseline_model{}".format(self.output_folder, ibest))
+            self.bilstm.reset_char_table()
         
         targets_t = [ex.get_aux_labels() for ex in test]
         dataset_t = self.get_adversary_dataset(test)
@@ -521,19 +673,28 @@ class PrModel:
 
 
 
+def load_runtime():
+    """Imports dynet, nltk and the models, once backend.init was called.
+
+    Not done at load time: main.py --help and modules that import main
+    (e.g. benchmark.py) do not load them.
+    """
+    global dy, example, MLP, MLP_sigmoid, get_encoder, Discriminator, Generator, NumpyEncoder, NumpyMLP
+    import _dynet as dy
+    import example
+    from classifier import MLP, MLP_sigmoid
+    from encoders import get_encoder
+    from discriminator import Discriminator, Generator
+    from numpy_inference import NumpyEncoder, NumpyMLP
+
 def main(args):
-    import dynet as dy
+    load_runtime()
+    print("Backend profile: {}".format(backend.describe()))
     
-    get_data = {"ag": lambda : ag_data_reader.get_dataset(args.num_NE),
-                "dw": lambda : dw_data_reader.get_dataset(args.num_NE),
-                "bl": lambda : blog_data_reader.get_dataset(),
-                "tp_fr": lambda : trustpilot_data_reader.get_dataset("fr"),
-                "tp_de": lambda : trustpilot_data_reader.get_dataset("de"),
-                "tp_dk": lambda : trustpilot_data_reader.get_dataset("dk"),
-                "tp_us": lambda : trustpilot_data_reader.get_dataset("us"),
-                "tp_uk": lambda : trustpilot_data_reader.get_dataset("uk")}
+    # raw texts are only used by the generator defense
+    example.KEEP_TEXT = args.generator
     
-    train, dev, test = get_data[args.dataset]()
+    train, dev, test = dataset_registry.get_dataset(args.dataset, args)
     
     labels_main_task = set([ex.get_label() for ex in train])
     labels_main_task.add(0)
@@ -561,9 +722,10 @@ def main(args):
     
     #if args.use_demographics:
     symbols = ["<g={}>".format(i) for i in ["F", "M"]] + ["<a={}>".format(i) for i in ["U", "O"]]
-    vocabulary = extract_vocabulary(train, add_symbols=symbols)
+    vocabulary = extract_vocabulary(train, add_symbols=symbols, min_freq=args.min_freq, max_size=args.max_vocab, n_buckets=args.oov_buckets)
+    print("Vocabulary: {} words ({} hashed buckets)".format(vocabulary.size_words(), args.oov_buckets))
     
-    bilstm = HierarchicalBiLSTM(args, vocabulary, model)
+    bilstm = get_encoder(args, vocabulary, model)
     input_size = bilstm.size()
     main_classifier = MLP(input_size, len(labels_main_task), args.hidden_layers, args.dim_hidden, dy.rectify, model)
     
@@ -682,8 +844,6 @@ def main(args):
 
 if __name__ == "__main__":
     import argparse
-    import random
-    import numpy as np
     import os
     random.seed(10)
     np.random.seed(10)
@@ -701,7 +861,7 @@ if __name__ == "__main__":
     
     parser = argparse.ArgumentParser(description = usage, formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument("output", help="Output folder")
-    parser.add_argument("dataset", choices=["ag", "dw", "tp_fr", "tp_de", "tp_dk", "tp_us", "tp_uk", "bl"], help="Dataset. tp=trustpilot, bl=blog")
+    parser.add_argument("dataset", choices=dataset_registry.names(), help="Dataset. tp=trustpilot, bl=blog")
     
     parser.add_argument("--iterations", "-i", type=int, default=20, help="Number of training iterations")
     parser.add_argument("--iterations-adversary", "-I", type=int, default=20, help="Number of training iterations for attacker")
@@ -713,8 +873,12 @@ if __name__ == "__main__":
     
     parser.add_argument("--adversary-type", choices=["logistic", "softmax"], default="logistic")
 
-    parser.add_argument("--dynet-seed", type=int, default=4 , help="random seed for dynet (needs to be first argument!)")
+    parser.add_argument("--dynet-seed", type=int, default=4 , help="random seed for dynet")
     parser.add_argument("--dynet-weight-decay", type=float, default=1e-6, help="Weight decay for dynet")
+    parser.add_argument("--profile", choices=list(backend.PROFILES), default="debug", help="Dynet runtime profile (see backend.py)")
+    parser.add_argument("--dynet-mem", type=str, default=None, help="Memory pool size in MB (overrides the profile)")
+    parser.add_argument("--dynet-autobatch", type=int, choices=[0, 1], default=None, help="Autobatching (overrides the profile)")
+    parser.add_argument("--threads", type=int, default=None, help="Intra-op threads, 0 = all cores (overrides the profile)")
 
 
     parser.add_argument("--dim-char","-c", type=int, default=50, help="Dimension of char embeddings")
@@ -727,6 +891,21 @@ if __name__ == "__main__":
     parser.add_argument("--hidden-layers", "-L", type=int, default=1, help="Number of hidden layers")
     parser.add_argument("--dim-hidden", "-l", type=int, default=50, help="Dimension of hidden layers")
     parser.add_argument("--use-char-lstm", action="store_true", help="Use a character LSTM, [default=false]")
+    parser.add_argument("--cell", choices=["vanilla", "compact", "gru"], default="vanilla", help="RNN cell of the encoder, char and generator LSTMs (see benchmark.py cells)")
+    
+    parser.add_argument("--min-freq", type=int, default=1, help="Minimum frequency of a word in the vocabulary")
+    parser.add_argument("--max-vocab", type=int, default=None, help="Maximum number of words in the vocabulary (most frequent)")
+    parser.add_argument("--oov-buckets", type=int, default=0, help="Hash words not in the vocabulary, and words dropped by stochastic replacement, into this many buckets instead of <UNK>")
+    
+    parser.add_argument("--batch-size", "-B", type=int, default=1, help="Minibatch size (examples of similar lengths are batched together)")
+    parser.add_argument("--adversary-batch-size", type=int, default=1, help="Minibatch size of the attacker, trained on fixed hidden vectors (e.g. 64: much faster)")
+    parser.add_argument("--numpy-inference", action="store_true", help="Evaluation / adversary datasets with the numpy engine instead of dynet graphs (vanilla LSTM encoder, not with --chunk-size)")
+    parser.add_argument("--encoder", choices=["lstm", "boe", "cnn"], default="lstm", help="Sentence encoder: bi-LSTM, bag of embeddings or CNN (boe / cnn are faster, see encoders.py)")
+    parser.add_argument("--cnn-window", type=int, default=3, help="CNN encoder: number of tokens per window")
+    parser.add_argument("--max-tokens", type=int, default=None, help="Maximum number of tokens per example (longer examples are truncated)")
+    parser.add_argument("--chunk-size", type=int, default=None, help="Hierarchical mode: encode sentences / chunks of at most n tokens independently, then aggregate them")
+    parser.add_argument("--aggregation", choices=["lstm", "mean", "max"], default="lstm", help="Hierarchical mode: aggregation of chunk vectors")
+    parser.add_argument("--bptt-chunks", type=int, default=None, help="Hierarchical mode: backpropagate only through the last n chunks of an example")
     
     parser.add_argument("--subset", "-S", type=int, default=None, help="Train on a subset of n examples for debugging")
     
@@ -743,9 +922,10 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
     
+    # dynet weight decay used to be read from sys.argv only: default 0
+    weight_decay = args.dynet_weight_decay if "--dynet-weight-decay" in sys.argv else 0
+    backend.init(args.profile, args.dynet_seed, weight_decay, mem=args.dynet_mem, autobatch=args.dynet_autobatch, threads=args.threads)
+
     os.makedirs(args.output, exist_ok=True)
-    
-    if "--dynet-seed" not in sys.argv:
-        sys.argv.extend(["--dynet-seed", str(args.dynet_seed)])
 
     main(args)
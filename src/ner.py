@@ -1,8 +1,13 @@
 
-import ag_data_reader
 import os
+import sys
+import subprocess
+import threading
+from multiprocessing import Pool
 
-from nltk import word_tokenize, pos_tag, ne_chunk
+import tokenization
+
+from nltk import word_tokenize, pos_tag, ne_chunk, pos_tag_sents, ne_chunk_sents
 from nltk.tag import StanfordNERTagger
 from collections import defaultdict
 
@@ -28,14 +33,7 @@ def get_NE(example):
 
     ner_sent = NER(sentence)
     
-    res = []
-    for c in ner_sent:
-        if type(c) != tuple:
-            label = c.label()
-            children = "_".join([a[0] for a in c])
-            res.append((label, children))
-    
-    return res
+    return entities(ner_sent)
 
 def NER(sentence):
     if type(sentence) == str:
@@ -45,34 +43,106 @@ def NER(sentence):
     
     return NE
 
-def save_NER(dataset, final_file):
-    out = open(final_file, "w")
+def entities(ner_sent):
     res = []
-    for ex in dataset:
-        ne = get_NE(ex)
-        res.append(ne)
-        line = " ".join(["/".join(t) for t in ne])
-        out.write("{}\n".format(line))
+    for c in ner_sent:
+        if type(c) != tuple:
+            label = c.label()
+            children = "_".join([a[0] for a in c])
+            res.append((label, children))
+    return res
+
+def example_key(example):
+    return tokenization.content_hash(" ".join(example.get_sentence()))
+
+def tag_chunk(chunk):
+    keys, sentences = zip(*chunk)
+    tagged = pos_tag_sents(sentences)
+    return [(k, entities(ne)) for k, ne in zip(keys, ne_chunk_sents(tagged))]
+
+def parse_NE_line(line):
+    if not line:
+        return []
+    return [tuple(e.split("/", 1)) for e in line.split(" ")]
+
+def format_NE_line(ne):
+    return " ".join(["/".join(t) for t in ne])
+
+def load_NER_index(index_file):
+    """Reads a cache file with lines 'content_hash<TAB>entities'"""
+    res = {}
+    if not os.path.isfile(index_file):
+        return res
+    with open(index_file, "r+") as ins:
+        lines = ins.read().split("\n")
+        # an interrupted run may leave a partial last line
+        if lines[-1] != "":
+            ins.truncate(len("\n".join(lines[:-1]).encode("utf8")) + (1 if len(lines) > 1 else 0))
+        for line in lines[:-1]:
+            key, _, ne = line.partition("\t")
+            res[key] = parse_NE_line(ne)
     return res
 
+def save_NER(dataset, index_file, chunk_size=500, n_jobs=None):
+    """Tags examples not in index_file, in chunks over a process pool.
+
+    Results are appended to index_file as chunks complete, so an
+    interrupted run resumes where it stopped.
+    """
+    res = load_NER_index(index_file)
+    todo = {}
+    for ex in dataset:
+        key = example_key(ex)
+        if key not in res:
+            todo[key] = ex.get_sentence()
+    todo = sorted(todo.items())
+    
+    if len(todo) > 0:
+        sys.stderr.write("NER tagging {} examples ({} already tagged)\n".format(len(todo), len(res)))
+        chunks = [todo[i:i+chunk_size] for i in range(0, len(todo), chunk_size)]
+        out = open(index_file, "a")
+        with Pool(n_jobs) as pool:
+            for tagged in pool.imap_unordered(tag_chunk, chunks):
+                for key, ne in tagged:
+                    res[key] = ne
+                    out.write("{}\t{}\n".format(key, format_NE_line(ne)))
+                out.flush()
+        out.close()
+    return [list(res[example_key(ex)]) for ex in dataset]
+
 def load_NER(dataset, final_file):
     ins = open(final_file, "r")
     res = []
     for line in ins:
-        line  = line.strip()
-        if not line:
-            res.append([])
-        else:
-            sline = [tuple(e.split("/")) for e in line.split(" ")]
-            res.append(sline)
+        res.append(parse_NE_line(line.strip()))
     return res
 
+def migrate_NER(dataset, final_file, index_file, n_check=50):
+    """Converts an old cache file, aligned with the dataset by line order.
+
+    The line order depends on the order in which the dataset was read: a
+    sample of examples is tagged again and the old file is only kept if it
+    agrees with it (otherwise every example is tagged again).
+    """
+    nes = load_NER(dataset, final_file)
+    if len(nes) != len(dataset):
+        return
+    step = max(1, len(dataset) // n_check)
+    sample = list(range(0, len(dataset), step))[:n_check]
+    tagged = tag_chunk([(i, dataset[i].get_sentence()) for i in sample])
+    if any(nes[i] != ne for i, ne in tagged):
+        sys.stderr.write("{} is not aligned with the dataset, ignored\n".format(final_file))
+        return
+    with open(index_file, "a") as out:
+        for ex, ne in zip(dataset, nes):
+            out.write("{}\t{}\n".format(example_key(ex), format_NE_line(ne)))
+
 def tags_NE(dataset, idcorpus, k=10, filter={'PERSON'}, keep_negatives=False):
     final_file = "../tools/ner_{}".format(idcorpus)
-    if not os.path.isfile(final_file):
-        nes = save_NER(dataset, final_file)
-    else:
-        nes = load_NER(dataset, final_file)
+    index_file = "{}.index".format(final_file)
+    if os.path.isfile(final_file) and not os.path.isfile(index_file):
+        migrate_NER(dataset, final_file, index_file)
+    nes = save_NER(dataset, index_file)
     
     counts = defaultdict(int)
     for e in nes:
@@ -104,25 +174,64 @@ def tags_NE(dataset, idcorpus, k=10, filter={'PERSON'}, keep_negatives=False):
     return newdataset
 
 
+STANFORD_DIR = "../tools/stanford-ner-2018-02-27/"
+STANFORD_CMD = ["java", "-mx600m", "-cp", "stanford-ner.jar:lib/*",
+                "edu.stanford.nlp.ie.crf.CRFClassifier",
+                "-loadClassifier", "classifiers/english.all.3class.distsim.crf.ser.gz",
+                "-tokenizerOptions", "tokenizeNLs=true",
+                "-readStdin"]
+# sent on its own line after each sentence. The tagger splits sentences at
+# punctuation as well, so output lines do not match input lines: the sentinel
+# token is the only sentence boundary
+SENTINEL = "ENDOFSENTENCEMARKER"
+
+def feed_stanford(stdin, sentence_list, chunk_size):
+    for i in range(0, len(sentence_list), chunk_size):
+        chunk = sentence_list[i:i+chunk_size]
+        stdin.write("".join(["{}\n{}\n".format(" ".join(s.split()), SENTINEL) for s in chunk]))
+        # -readStdin buffers its input until a blank line: one document per chunk
+        stdin.write("\n")
+        stdin.flush()
+    stdin.close()
+
+def tag_stanford(sentence_list, chunk_size=1000):
+    """Tags sentences with a single long-lived Stanford NER process.
+
+    Sentences are written to its stdin in chunks by a separate thread while
+    tagged sentences are read back from its stdout (one JVM for the whole
+    corpus instead of one per sentence).
+    """
+    sentence_list = list(sentence_list)
+    process = subprocess.Popen(STANFORD_CMD, cwd=STANFORD_DIR, universal_newlines=True,
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL)
+    writer = threading.Thread(target=feed_stanford, args=(process.stdin, sentence_list, chunk_size))
+    writer.start()
+    
+    current = []
+    n_tagged = 0
+    for line in process.stdout:
+        for token in line.split():
+            if token.rsplit("/", 1)[0] == SENTINEL:
+                yield " ".join(current)
+                n_tagged += 1
+                current = []
+            else:
+                current.append(token)
+    
+    writer.join()
+    process.wait()
+    assert(n_tagged == len(sentence_list) and current == [])
+
 def NER_stanford(sentence_list, idcorpus):
     final_file = "../tools/tmp_filename_all_{}.ner".format(idcorpus)
     if not os.path.isfile(final_file):
-        all_out = open(final_file, "w")
-        os.chdir("../tools/stanford-ner-2018-02-27/")
-        
-        for i, s in enumerate(sentence_list):
-            tmpfile = open("../tmp_filename_{}".format(idcorpus), "w")
-            tmpfile.write("{}\n".format(s))
-            tmpfile.close()
-            
-            outfile = "../tmp_filename_{}.ner".format(idcorpus)
-            os.system("java -mx600m -cp stanford-ner.jar:lib/* edu.stanford.nlp.ie.crf.CRFClassifier -loadClassifier classifiers/english.all.3class.distsim.crf.ser.gz -textFile ../tmp_filename_{} > {}".format(idcorpus, outfile))
-            
-            res = " ".join(open(outfile).read().split("\n"))
+        tmp = "{}.tmp".format(final_file)
+        all_out = open(tmp, "w")
+        for res in tag_stanford(sentence_list):
             all_out.write("{}\n".format(res))
-        
         all_out.close()
-        os.chdir("../../src/")
+        os.replace(tmp, final_file)
     
     tmpfile = open(final_file)
     res = []
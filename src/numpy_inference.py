@@ -0,0 +1,155 @@
+import numpy as np
+
+"""
+Graph-free inference with a trained HierarchicalBiLSTM and MLP classifiers.
+
+NumpyEncoder and NumpyMLP copy the parameters of the dynet models into
+numpy arrays when they are built (build them again after training
+updates). The LSTMs run one matrix product per time step over padded
+batches, and give the same outputs as the dynet models with dropout
+disabled, up to float precision.
+"""
+
+# dynet VanillaLSTMBuilder: gates i, f, o, g and a forget gate bias of 1
+FORGET_BIAS = 1.0
+
+
+def sigmoid(x):
+    # no overflow for large negative values
+    return 0.5 * (1 + np.tanh(0.5 * x))
+
+
+def relu(x):
+    return np.maximum(x, 0)
+
+
+ACTIVATIONS = {"rectify": relu, "tanh": np.tanh, "logistic": sigmoid}
+
+
+def export_lstm(builder):
+    # parameters of the (single) layer: Wx (4h x in), Wh (4h x h), b (4h)
+    return [p.as_array().astype(np.float32) for p in builder.get_parameters()[0]]
+
+
+def lstm_last_states(params, inputs, lengths):
+    """Runs an LSTM over a padded batch.
+
+    inputs: (T, batch, dim) array, sequence b has lengths[b] elements.
+    Returns the state at the last position of each sequence, (batch, hidden).
+    """
+    Wx, Wh, b = params
+    n = Wh.shape[1]
+    T, batch, _ = inputs.shape
+    # input projections of all the time steps at once
+    X = inputs @ Wx.T + b
+    X[:, :, n:2*n] += FORGET_BIAS
+    Wh_T = Wh.T
+    h = np.zeros((batch, n), dtype=np.float32)
+    c = np.zeros((batch, n), dtype=np.float32)
+    last = np.zeros((batch, n), dtype=np.float32)
+    lengths = np.asarray(lengths)
+    for t in range(T):
+        gates = X[t] + h @ Wh_T
+        ifo = sigmoid(gates[:, :3*n])
+        g = np.tanh(gates[:, 3*n:])
+        c = ifo[:, n:2*n] * c + ifo[:, :n] * g
+        h = ifo[:, 2*n:] * np.tanh(c)
+        done = lengths == t + 1
+        last[done] = h[done]
+    return last
+
+
+def pad(sequences, dim):
+    # (T, batch, dim) array from a list of (length, dim) arrays
+    padded = np.zeros((max(len(s) for s in sequences), len(sequences), dim), dtype=np.float32)
+    for b, s in enumerate(sequences):
+        padded[:len(s), b] = s
+    return padded
+
+
+class NumpyEncoder:
+    """Sentence vectors of a HierarchicalBiLSTM (not the chunked encoder)"""
+    def __init__(self, bilstm):
+        self.bilstm = bilstm
+        self.bi = bilstm.bi
+        self.dim_input = bilstm.dim_input
+        self.words = bilstm.words.as_array().astype(np.float32)
+        self.wrnn = [export_lstm(b) for b in bilstm.wrnn]
+        if bilstm.crnn is not None:
+            self.chars = bilstm.chars.as_array().astype(np.float32)
+            self.crnn = [export_lstm(b) for b in bilstm.crnn]
+        else:
+            self.crnn = None
+        # char LSTM encodings of word types (as tuples of char ids)
+        self.char_table = {}
+
+    def encode_chars(self, keys, chunk_size=256):
+        missing = sorted({k for k in keys if k not in self.char_table}, key=len)
+        for i in range(0, len(missing), chunk_size):
+            chunk = missing[i:i+chunk_size]
+            lengths = [len(k) for k in chunk]
+            f = lstm_last_states(self.crnn[0], pad([self.chars[list(k)] for k in chunk], self.chars.shape[1]), lengths)
+            b = lstm_last_states(self.crnn[1], pad([self.chars[list(k[::-1])] for k in chunk], self.chars.shape[1]), lengths)
+            for k, v in zip(chunk, np.concatenate([f, b], axis=1)):
+                self.char_table[k] = v
+
+    def get_static_representations(self, coded_sentence):
+        word_embeddings = self.words[[token[0] for token in coded_sentence]]
+        if self.crnn is None:
+            return word_embeddings
+        keys = [tuple(token[1]) for token in coded_sentence]
+        return np.concatenate([np.array([self.char_table[k] for k in keys]).reshape(len(keys), -1), word_embeddings], axis=1)
+
+    def encode(self, examples, training=False, prefixes=None):
+        """Same vectors as bilstm.build_batch_representations, as a (batch, size) array"""
+        if prefixes is None:
+            prefixes = [[] for _ in examples]
+        forward = []
+        prefix_lengths = []
+        for example, prefix in zip(examples, prefixes):
+            coded_sentence = self.bilstm.code_example(example, training)
+            coded_prefix = self.bilstm.vocabulary.code_sentence_cw(prefix, training)
+            forward.append(coded_prefix + coded_sentence)
+            prefix_lengths.append(len(coded_prefix))
+        if self.crnn is not None:
+            # all the words of the batch at once
+            self.encode_chars([tuple(token[1]) for c in forward for token in c])
+        static = [self.get_static_representations(c) for c in forward]
+        lengths = [len(s) for s in static]
+
+        vectors = lstm_last_states(self.wrnn[0], pad(static, self.dim_input), lengths)
+        if not self.bi:
+            return vectors
+        backward = [np.concatenate([s[:p], s[p:][::-1]]) for s, p in zip(static, prefix_lengths)]
+        return np.concatenate([vectors, lstm_last_states(self.wrnn[1], pad(backward, self.dim_input), lengths)], axis=1)
+
+
+class NumpyMLP:
+    """Outputs of a MLP (softmax) or MLP_sigmoid classifier for a (batch, dim_in) array"""
+    def __init__(self, mlp):
+        self.parameters = [(W.as_array().astype(np.float32), b.as_array().astype(np.float32)) for W, b in mlp.parameters]
+        self.activation = ACTIVATIONS[mlp.activation.__name__]
+        self.multilabel = type(mlp).__name__ == "MLP_sigmoid"
+        self.dim_out = mlp.dim_out
+
+    def output(self, X):
+        for W, b in self.parameters[:-1]:
+            X = self.activation(X @ W.T + b)
+        W, b = self.parameters[-1]
+        X = X @ W.T + b
+        if self.multilabel:
+            return sigmoid(X)
+        X = np.exp(X - X.max(axis=1, keepdims=True))
+        return X / X.sum(axis=1, keepdims=True)
+
+    def get_loss_and_prediction(self, X, targets, epsilon = 1e-10):
+        """Losses (batch,) and predictions, as returned by get_batch_loss_and_prediction"""
+        output = self.output(X).astype(np.float64)
+        if not self.multilabel:
+            losses = - np.log(output[np.arange(len(targets)), targets] + epsilon)
+            return losses, [int(p) for p in np.argmax(output, axis=1)]
+        ys = np.zeros(output.shape)
+        for b, t in enumerate(targets):
+            ys[b, list(t)] = 1
+        losses = - (ys * np.log(output + epsilon) + (1 - ys) * np.log(1 - output + epsilon)).sum(axis=1)
+        return losses, [{int(i) for i in np.nonzero(o > 0.5)[0]} for o in output]
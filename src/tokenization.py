@@ -0,0 +1,68 @@
+import os
+import sys
+import pickle
+import hashlib
+from multiprocessing import Pool
+
+import nltk.tokenize as tokenizer
+
+CACHE_FOLDER = "../cache"
+
+
+def content_hash(text):
+    return hashlib.sha1(text.encode("utf8", "surrogatepass")).hexdigest()
+
+
+def tokenize_chunk(texts):
+    return [tokenizer.word_tokenize(t) for t in texts]
+
+
+def cache_filename(idcorpus):
+    return "{}/tokens_{}".format(CACHE_FOLDER, idcorpus)
+
+
+def load_cache(idcorpus):
+    filename = cache_filename(idcorpus)
+    if not os.path.isfile(filename):
+        return {}
+    with open(filename, "rb") as ins:
+        return pickle.load(ins)
+
+
+def save_cache(idcorpus, cache):
+    # write then rename: concurrent runs never read a partial file
+    os.makedirs(CACHE_FOLDER, exist_ok=True)
+    filename = cache_filename(idcorpus)
+    tmp = "{}.{}.tmp".format(filename, os.getpid())
+    with open(tmp, "wb") as out:
+        pickle.dump(cache, out, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, filename)
+
+
+def tokenize_all(texts, idcorpus=None, n_jobs=None, chunk_size=2000):
+    """Tokenizes a list of strings with a process pool.
+
+    If idcorpus is given, tokens are read from / added to an on-disk cache
+    keyed by corpus id and content hash of each text.
+    """
+    texts = list(texts)
+    cache = load_cache(idcorpus) if idcorpus is not None else {}
+
+    keys = [content_hash(t) for t in texts]
+    todo = sorted({k: t for k, t in zip(keys, texts) if k not in cache}.items())
+
+    if len(todo) > 0:
+        sys.stderr.write("Tokenizing {} texts ({} reused)\n".format(len(todo), len(texts) - len(todo)))
+        chunks = [[t for _, t in todo[i:i+chunk_size]] for i in range(0, len(todo), chunk_size)]
+        if n_jobs == 1 or len(chunks) == 1:
+            results = [tokenize_chunk(c) for c in chunks]
+        else:
+            with Pool(n_jobs) as pool:
+                results = pool.map(tokenize_chunk, chunks)
+        tokenized = [tokens for chunk in results for tokens in chunk]
+        for (k, _), tokens in zip(todo, tokenized):
+            cache[k] = tokens
+        if idcorpus is not None:
+            save_cache(idcorpus, cache)
+
+    return [cache[k] for k in keys]
@@ -1,8 +1,13 @@
 
 from ast import literal_eval
 from pprint import pprint
+from multiprocessing import Pool
+import json
+import os
 
 from example import Example
+import tokenization
+import dataset_cache
 
 import random
 random.seed(10)
@@ -45,47 +50,110 @@ def bucket_age(birth_date, date):
     
     return None
 
-def get_raw_data(filename):
-    data = []
-    with open(filename) as f:
+def keep_line(line):
+    # cheap test on the raw bytes, before any parsing:
+    # drops users without gender or birth year
+    if b"gender" not in line or b"birth_year" not in line:
+        return False
+    for null in [b"'gender': None", b'"gender": null', b"'birth_year': None", b'"birth_year": null']:
+        if null in line:
+            return False
+    return True
+
+def parse_json(line):
+    return json.loads(line)
+
+def parse_repr(line):
+    # files written with python's repr instead of json
+    return literal_eval(line.decode("utf8"))
+
+def line_parser(filename):
+    """Parser for the lines of filename, from the format of its first line"""
+    with open(filename, "rb") as f:
+        first = f.readline()
+    try:
+        json.loads(first)
+        return parse_json
+    except ValueError:
+        return parse_repr
+
+def iter_raw_data(filename, start=0, end=None, parse_line=None):
+    """Yields parsed users whose line starts in byte range [start, end)"""
+    if parse_line is None:
+        parse_line = line_parser(filename)
+    with open(filename, "rb") as f:
+        if start > 0:
+            # the line that contains start belongs to the previous chunk
+            f.seek(start - 1)
+            f.readline()
+        pos = f.tell()
         for line in f:
-            obj = literal_eval(line)
-            data.append(obj)
-    return data
+            if end is not None and pos >= end:
+                break
+            pos += len(line)
+            if keep_line(line):
+                yield parse_line(line)
 
+def get_raw_data(filename):
+    return list(iter_raw_data(filename))
 
-def construct_examples(raw_data):
-    examples = []
-    for o in raw_data:
-        d = o['reviews'][0]
-        if None in [d['text'], d['rating']]:
-            continue
-        if d['title'] is None:
-            d['title'] = ""
-        
-        review = d['title'] + " " + " STOP START ".join(d['text'])
 
-        if 'gender' in o and 'birth_year' in o:
-            if o['gender'] is None or o['birth_year'] is None:
-                continue
-            gen = map_gender[o['gender']]
-            age = bucket_age(o['birth_year'], d['date'])
+def make_record(o):
+    d = o['reviews'][0]
+    if None in [d['text'], d['rating']]:
+        return None
+    if d['title'] is None:
+        d['title'] = ""
+    
+    review = d['title'] + " " + " STOP START ".join(d['text'])
+
+    if 'gender' in o and 'birth_year' in o:
+        if o['gender'] is None or o['birth_year'] is None:
+            return None
+        gen = map_gender[o['gender']]
+        age = bucket_age(o['birth_year'], d['date'])
+        
+        if age != None:
             
-            if age != None:
-                
-                meta = set()
-                if gen:
-                    meta.add(GENDER)
-                if age:
-                    meta.add(BIRTH)
-                ex = Example(review, int(d['rating']) - 1, metadata=meta)
-                
-                if len(ex.get_sentence()) == 0:
-                    continue
-                examples.append(ex)
+            meta = set()
+            if gen:
+                meta.add(GENDER)
+            if age:
+                meta.add(BIRTH)
+            return review, int(d['rating']) - 1, meta
+    return None
+
+def read_chunk(chunk):
+    filename, start, end, parse_line = chunk
+    records = [make_record(o) for o in iter_raw_data(filename, start, end, parse_line)]
+    return [r for r in records if r is not None]
+
+def iter_records(filename, n_jobs=None, chunk_size=2**24):
+    """Streams (review, label, meta) records, the file is split by byte
+    offset into chunks parsed by a pool of workers (in file order)"""
+    size = os.path.getsize(filename)
+    parse_line = line_parser(filename)
+    chunks = [(filename, i, i + chunk_size, parse_line) for i in range(0, size, chunk_size)]
+    with Pool(n_jobs) as pool:
+        for records in pool.imap(read_chunk, chunks):
+            yield from records
+
+
+def construct_examples(raw_data, idcorpus=None):
+    records = [make_record(o) for o in raw_data]
+    return examples_from_records([r for r in records if r is not None], idcorpus)
+
+def examples_from_records(records, idcorpus=None):
+    tokens = tokenization.tokenize_all([r[0] for r in records], idcorpus)
+    examples = []
+    for (review, label, meta), toks in zip(records, tokens):
+        if len(toks) == 0:
+            continue
+        examples.append(Example(review, label, metadata=meta, tokens=toks))
     return examples
 
 
+@dataset_cache.cached("tp")
 def get_dataset(lang):
     lang_map = {"fr": "france",
                 "de": "germany",
@@ -98,8 +166,8 @@ def get_dataset(lang):
         filler = "geocoded"
     filename = "../datasets/src/{}.auto-adjusted_gender.{}.jsonl.tmp_filtered".format(lang_map[lang], filler)
     
-    raw_data = get_raw_data(filename)
-    examples = construct_examples(raw_data)
+    records = list(iter_records(filename))
+    examples = examples_from_records(records, "tp_{}".format(lang))
     
     #if add_demographics:
         #for ex in examples:
@@ -1,5 +1,9 @@
 #! /usr/bin/python3
+import zlib
+import mmap
+import weakref
 import numpy as np
+from collections import defaultdict
 
 
 ALPHA = 0.8375  # stochastic replacement constant
@@ -10,45 +14,145 @@ STOP = "STOP"
 
 UNK_I, UNDEF_I, START_I, STOP_I = list(range(4))
 
+MAGIC = b"PNETVOC1"
+
+
+def decode_strings(buffer, start, offsets):
+    return [bytes(buffer[start+offsets[i]:start+offsets[i+1]]).decode("utf8", "surrogatepass")
+            for i in range(len(offsets) - 1)]
+
 class Vocabulary:
 
-    def __init__(self, word_freqs):
+    def __init__(self, word_freqs, min_freq=1, max_size=None, n_buckets=0):
+        """
+        Keeps words with frequency >= min_freq, at most max_size of them
+        (most frequent first). If n_buckets > 0, other words are hashed
+        into n_buckets ids instead of UNK_I, and so are the words dropped by
+        stochastic replacement (otherwise buckets are never trained when
+        every training word is kept).
+        """
+        self._word_freqs = word_freqs
+        self.n_buckets = n_buckets
+
+        kept = [w for w in word_freqs if word_freqs[w] >= min_freq]
+        if max_size is not None and len(kept) > max_size:
+            kept = sorted(kept, key = lambda w: (-word_freqs[w], w))[:max_size]
 
-        self.word_freqs = word_freqs
-        self.words = [UNK, UNDEF, START, STOP] + sorted(word_freqs)
-        self.w2i = {w: i for i, w in enumerate(self.words)}
+        self._words = [UNK, UNDEF, START, STOP] + sorted(kept)
+        self.n_kept = len(self._words)
+        self._words += ["<OOV_{}>".format(i) for i in range(n_buckets)]
+        self._w2i = None
 
+        # chars of all words seen, including those not kept
         self.c2i = {}
         self.chars = set()
-        for w in self.words:
+        for w in [UNK, UNDEF, START, STOP] + list(word_freqs):
             self.chars |= set(w)
         self.chars = [UNK, UNDEF, START, STOP] + sorted(self.chars) + [" "]
         self.c2i = {c: i for i, c in enumerate(self.chars)}
 
-    def save(self, filename):
-        out = open("{}_words".format(filename), "w")
-        for w in self.words:
-            out.write("{}\n".format(w))
-        out.close()
-        out = open("{}_chars".format(filename), "w")
-        for c in self.chars:
-            out.write("{}\n".format(c))
-        out.close()
+        # encoding tables for the token types of each TokenStore, dropped
+        # with the store (an id() key could be reused by a new store)
+        self.encoded_stores = weakref.WeakKeyDictionary()
 
-    def load(self, filename):
-        self.words = []
-        ins = open("{}_words".format(filename), "r")
-        for line in ins:
-            self.words.append(line.strip())
-        self.w2i = {w: i for i, w in enumerate(self.words)}
-        ins.close()
+    # words, w2i and word_freqs are built on first use for a loaded vocabulary
 
-        self.chars = []
-        ins = open("{}_chars".format(filename), "r")
-        for line in ins:
-            self.chars.append(line.strip())
-        self.c2i = {c: i for i, c in enumerate(self.chars)}
+    @property
+    def words(self):
+        if self._words is None:
+            kept = decode_strings(self._mmap, *self._sections["kept"])
+            self._words = kept + ["<OOV_{}>".format(i) for i in range(self.n_buckets)]
+        return self._words
+
+    @property
+    def w2i(self):
+        if self._w2i is None:
+            self._w2i = {w: i for i, w in enumerate(self.words[:self.n_kept])}
+        return self._w2i
+
+    @property
+    def word_freqs(self):
+        if self._word_freqs is None:
+            self._word_freqs = defaultdict(int)
+            for name in ["kept", "others"]:
+                words = decode_strings(self._mmap, *self._sections[name])
+                freqs = self._sections["{}_freqs".format(name)]
+                self._word_freqs.update(zip(words, freqs.tolist()))
+            # specials have no frequency unless they were in the training data
+            for w in [w for w in self._word_freqs if self._word_freqs[w] < 0]:
+                del self._word_freqs[w]
+        return self._word_freqs
+
+    """
+    Binary format (single file, little endian):
+        magic                   8 bytes
+        header                  int64 x 5: n_kept, n_others, n_chars, n_buckets, _
+        kept_offsets            int64 x (n_kept + 1)     words with an id
+        kept_freqs              int64 x n_kept           (-1: no frequency)
+        others_offsets          int64 x (n_others + 1)   words without id
+        others_freqs            int64 x n_others
+        chars_offsets           int64 x (n_chars + 1)
+        utf8 strings of kept words, other words and chars
+    """
 
+    def save(self, filename):
+        freqs = self.word_freqs
+        kept = self.words[:self.n_kept]
+        kept_set = set(kept)
+        others = [w for w in freqs if w not in kept_set]
+        sections = [(kept, [freqs[w] if w in freqs else -1 for w in kept]),
+                    (others, [freqs[w] for w in others]),
+                    (self.chars, None)]
+        header = np.array([self.n_kept, len(others), len(self.chars), self.n_buckets, 0], dtype="<i8")
+        blobs = []
+        with open(filename, "wb") as out:
+            out.write(MAGIC)
+            out.write(header.tobytes())
+            for strings, strings_freqs in sections:
+                data = [s.encode("utf8", "surrogatepass") for s in strings]
+                offsets = np.zeros(len(data) + 1, dtype="<i8")
+                offsets[1:] = np.cumsum([len(d) for d in data])
+                out.write(offsets.tobytes())
+                if strings_freqs is not None:
+                    out.write(np.array(strings_freqs, dtype="<i8").tobytes())
+                blobs.append(b"".join(data))
+            for blob in blobs:
+                out.write(blob)
+
+    @classmethod
+    def load(cls, filename):
+        voc = cls.__new__(cls)
+        with open(filename, "rb") as ins:
+            voc._mmap = mmap.mmap(ins.fileno(), 0, access=mmap.ACCESS_READ)
+        assert(voc._mmap[:len(MAGIC)] == MAGIC)
+        pos = len(MAGIC)
+        def read_ints(n):
+            nonlocal pos
+            res = np.frombuffer(voc._mmap, dtype="<i8", count=n, offset=pos)
+            pos += 8 * n
+            return res
+        n_kept, n_others, n_chars, n_buckets, _ = read_ints(5).tolist()
+        offsets = {}
+        sections = {}
+        offsets["kept"] = read_ints(n_kept + 1)
+        sections["kept_freqs"] = read_ints(n_kept)
+        offsets["others"] = read_ints(n_others + 1)
+        sections["others_freqs"] = read_ints(n_others)
+        offsets["chars"] = read_ints(n_chars + 1)
+        for name in ["kept", "others", "chars"]:
+            sections[name] = (pos, offsets[name])
+            pos += int(offsets[name][-1])
+        voc._sections = sections
+
+        voc.n_kept = n_kept
+        voc.n_buckets = n_buckets
+        voc._words = None
+        voc._w2i = None
+        voc._word_freqs = None
+        voc.chars = decode_strings(voc._mmap, *sections["chars"])
+        voc.c2i = {c: i for i, c in enumerate(voc.chars)}
+        voc.encoded_stores = weakref.WeakKeyDictionary()
+        return voc
 
     def code_sentence_w(self, sentence, stochastic_replacement=False):
         return [self.code_word(w, stochastic_replacement) for w in sentence]
@@ -64,22 +168,84 @@ class Vocabulary:
         if stochastic_replacement:
             threshold = ALPHA / (ALPHA + self.word_freqs[w])
             if np.random.random() < threshold:
-                return UNK_I
-            else:
-                return self.w2i[w]
-        else:
-            if w in self.w2i:
-                return self.w2i[w]
-            else:
-                return UNK_I
+                return self.unk_id(w)
+        if w in self.w2i:
+            return self.w2i[w]
+        return self.unk_id(w)
+
+    def unk_id(self, w):
+        """Id of w when it is not in the vocabulary or is replaced"""
+        if self.n_buckets > 0:
+            return self.n_kept + zlib.crc32(w.encode("utf8", "surrogatepass")) % self.n_buckets
+        return UNK_I
 
     def code_chars(self, w):
         if w in {START, STOP, UNDEF, UNK}:
             return [UNDEF_I]
         return [self.c2i[c] if c in self.c2i else UNK_I for c in [START] + list(w) + [STOP]]
 
+    def code_types(self, types):
+        """Encodes a list of token types at once.
+
+        Returns word ids (one per type) and char ids of all types as a flat
+        array, type i has chars char_ids[char_offsets[i]:char_offsets[i+1]].
+        """
+        word_ids = np.array([self.code_word(w) for w in types], dtype=np.int32)
+        chars = [self.code_chars(w) for w in types]
+        char_offsets = np.zeros(len(types) + 1, dtype=np.int64)
+        char_offsets[1:] = np.cumsum([len(c) for c in chars])
+        char_ids = np.fromiter((c for cs in chars for c in cs), dtype=np.int32, count=char_offsets[-1])
+        return word_ids, char_ids, char_offsets
+
+    def encode_store(self, store):
+        """Encodes every token of a TokenStore (i.e. of a whole dataset) once.
+
+        Returns word ids of all tokens (aligned with store.ids), the
+        char ids, the stochastic replacement threshold and the replacement
+        id of each token type.
+        """
+        if store in self.encoded_stores and self.encoded_stores[store][0] == len(store.ids):
+            return self.encoded_stores[store][1]
+        word_ids, char_ids, char_offsets = self.code_types(store.types)
+        token_word_ids = word_ids[np.asarray(store.ids, dtype=np.int64)]
+        type_chars = [char_ids[char_offsets[i]:char_offsets[i+1]].tolist() for i in range(len(store.types))]
+        unk_ids = np.array([self.unk_id(w) for w in store.types], dtype=word_ids.dtype)
+        encoded = (token_word_ids, type_chars, self.replacement_thresholds(store.types), unk_ids)
+        self.encoded_stores[store] = (len(store.ids), encoded)
+        return encoded
+
+    def replacement_thresholds(self, types):
+        # -1: special symbols, never replaced (and no random draw)
+        specials = {START, STOP, UNDEF, UNK}
+        return np.array([-1 if w in specials else ALPHA / (ALPHA + self.word_freqs.get(w, 0))
+                         for w in types], dtype=np.float64)
+
+    def replace_unk(self, word_ids, thresholds, unk_ids):
+        """Stochastic replacement of a sentence or a whole minibatch at once.
+
+        word_ids, thresholds and unk_ids (the ids replaced tokens get) are
+        aligned arrays. Draws one random number per non special token, in
+        order, as successive code_word calls do.
+        """
+        draw = thresholds >= 0
+        replace = np.zeros(len(word_ids), dtype=bool)
+        replace[draw] = np.random.random(np.count_nonzero(draw)) < thresholds[draw]
+        word_ids = word_ids.copy()
+        word_ids[replace] = unk_ids[replace]
+        return word_ids
+
+    def code_example(self, example, stochastic_replacement=False):
+        """Same output as code_sentence_cw(example.get_sentence()), from precomputed arrays"""
+        store = example.store
+        token_word_ids, type_chars, type_thresholds, type_unk_ids = self.encode_store(store)
+        type_ids = example.get_token_ids()
+        word_ids = token_word_ids[store.offsets[example.index]:store.offsets[example.index+1]]
+        if stochastic_replacement:
+            word_ids = self.replace_unk(word_ids, type_thresholds[type_ids], type_unk_ids[type_ids])
+        return [(w, type_chars[t]) for w, t in zip(word_ids.tolist(), type_ids)]
+
     def size_words(self):
-        return len(self.words)
+        return self.n_kept + self.n_buckets
 
     def size_chars(self):
         return len(self.chars)